@@ -13,9 +13,16 @@ class PackagePermissionInline(admin.TabularInline):
 
 class PackageAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'category', 'price',
-                    'rating', 'tour_length', 'start')
+                    'rating', 'tour_length', 'start', 'can_write')
     inlines = (PackagePermissionInline,)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate_can_write(request.user)
+
+    @admin.display(boolean=True, ordering='can_write')
+    def can_write(self, obj):
+        return obj.can_write
+
 
 class ActivityLogAdmin(admin.ModelAdmin):
     list_display = ('id', 'action')
@@ -1,7 +1,12 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_migrate
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate, post_save, post_delete, m2m_changed
 
-from api.utils import assign_perms
+from demo.db import configure_sqlite
+
+from api.utils import assign_perms, bump_model_version, clear_group_perm_memos, on_commit_once
 
 
 def setup_group_permissions(sender, **kwargs):
@@ -19,8 +24,93 @@ def setup_group_permissions(sender, **kwargs):
     })
 
 
+def create_cache_tables(sender, using, **kwargs):
+    del sender, kwargs
+    call_command('createcachetable', database=using, verbosity=0)
+
+
+def invalidate_owned_packages(sender, instance, **kwargs):
+    del kwargs
+    # Dropped after the commit, so that a concurrent request cannot cache
+    # the IDs it read before the commit once they are invalidated
+    user_id = instance.user_id
+    on_commit_once(
+        sender.owned_packages_cache_key(user_id),
+        lambda: sender.invalidate_owned_package_ids(user_id))
+
+
+def invalidate_group_perm_memos(sender, **kwargs):
+    del sender, kwargs
+    clear_group_perm_memos()
+
+
+def index_package(sender, instance, **kwargs):
+    del sender, kwargs
+    from api.search import index_packages
+    index_packages([instance])
+
+
+def unindex_package(sender, instance, **kwargs):
+    del sender, kwargs
+    from api.search import unindex_packages
+    unindex_packages([instance.pk])
+
+
+def invalidate_access_token(sender, instance, **kwargs):
+    del sender, kwargs
+    from api.oauth2 import invalidate_access_tokens
+    invalidate_access_tokens(instance.token)
+
+
+def bump_version(sender, **kwargs):
+    del kwargs
+    bump_model_version(sender)
+
+
 class ApiConfig(AppConfig):
     name = 'api'
 
     def ready(self):
+        connection_created.connect(configure_sqlite)
         post_migrate.connect(setup_group_permissions, sender=self)
+        post_migrate.connect(create_cache_tables, sender=self)
+
+        package_permission = self.get_model('PackagePermission')
+        post_save.connect(invalidate_owned_packages, sender=package_permission)
+        post_delete.connect(
+            invalidate_owned_packages, sender=package_permission)
+
+        package = self.get_model('Package')
+        post_save.connect(index_package, sender=package)
+        post_delete.connect(unindex_package, sender=package)
+
+        for model in (package, package_permission, self.get_model('Booking')):
+            post_save.connect(bump_version, sender=model)
+            post_delete.connect(bump_version, sender=model)
+
+        # Both sides of a many-to-many relation send m2m_changed with the
+        # same through model as sender, so these also cover
+        # group.user_set and permission.group_set.
+        user_model = self.apps.get_model('auth', 'User')
+        group_model = self.apps.get_model('auth', 'Group')
+        m2m_changed.connect(
+            invalidate_group_perm_memos, sender=user_model.groups.through)
+        m2m_changed.connect(
+            invalidate_group_perm_memos,
+            sender=group_model.permissions.through)
+
+        from guardian.utils import get_group_obj_perms_model
+        group_object_permission = get_group_obj_perms_model()
+        post_save.connect(
+            invalidate_group_perm_memos, sender=group_object_permission)
+        post_delete.connect(
+            invalidate_group_perm_memos, sender=group_object_permission)
+
+        from oauth2_provider.models import get_access_token_model
+        from api.oauth2 import clear_request_memo, start_request_memo
+        access_token_model = get_access_token_model()
+        post_save.connect(invalidate_access_token, sender=access_token_model)
+        post_delete.connect(
+            invalidate_access_token, sender=access_token_model)
+        request_started.connect(start_request_memo)
+        request_finished.connect(clear_request_memo)
@@ -0,0 +1,87 @@
+import django_filters
+from django.db.models import Case, CharField, Count, Value, When
+
+from api.models import Package
+
+# Upper bounds of the price and tour length facet ranges. A range is
+# labelled "<min>-<max>", with "*" for an open end, e.g. "100-500".
+PRICE_FACET_BOUNDS = (100, 500, 1000, 5000)
+TOUR_LENGTH_FACET_BOUNDS = (4, 8, 15)
+
+
+class CharInFilter(django_filters.BaseInFilter, django_filters.CharFilter):
+    pass
+
+
+class PackageFilter(django_filters.FilterSet):
+    """
+    `category` and `rating` take comma-separated values, `price` and
+    `tour_length` take `_min`/`_max` bounds and `start` takes
+    `_after`/`_before` dates.
+    """
+    category = CharInFilter(lookup_expr='in')
+    rating = CharInFilter(lookup_expr='in')
+    price = django_filters.RangeFilter()
+    start = django_filters.DateFromToRangeFilter()
+    tour_length = django_filters.RangeFilter()
+
+    class Meta:
+        model = Package
+        fields = ('category', 'rating', 'price', 'start', 'tour_length')
+
+
+def range_label(lower, upper):
+    return '{}-{}'.format(
+        '*' if lower is None else lower, '*' if upper is None else upper)
+
+
+def range_bucket(field_name, bounds):
+    """
+    Expression labelling each row with the facet range its `field_name`
+    falls in.
+    """
+    whens = []
+    lower = None
+    for upper in bounds:
+        whens.append(When(
+            **{'{}__lt'.format(field_name): upper},
+            then=Value(range_label(lower, upper)),
+        ))
+        lower = upper
+    return Case(
+        *whens,
+        default=Value(range_label(lower, None)),
+        output_field=CharField(),
+    )
+
+
+def package_facets(queryset):
+    """
+    Counts the packages of `queryset` per category, rating, price range
+    and tour length range, with a single GROUP BY query.
+    """
+    rows = queryset.order_by().values(
+        'category',
+        'rating',
+        price_range=range_bucket('price', PRICE_FACET_BOUNDS),
+        tour_length_range=range_bucket('tour_length', TOUR_LENGTH_FACET_BOUNDS),
+    ).annotate(count=Count('id'))
+
+    facets = {
+        'count': 0,
+        'category': {},
+        'rating': {},
+        'price': {},
+        'tour_length': {},
+    }
+    for row in rows:
+        facets['count'] += row['count']
+        for facet, key in (
+            ('category', 'category'),
+            ('rating', 'rating'),
+            ('price', 'price_range'),
+            ('tour_length', 'tour_length_range'),
+        ):
+            value = row[key]
+            facets[facet][value] = facets[facet].get(value, 0) + row['count']
+    return facets
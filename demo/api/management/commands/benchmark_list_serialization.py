@@ -0,0 +1,70 @@
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import Booking, Package
+from api.serializers import BookingSerializer, PackageSerializer, compile_values_serializer
+
+
+class Command(BaseCommand):
+    help = ('Compares serializing list pages from model instances with the '
+            'values() path of FastListMixin, on rows that are rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        del args
+        with transaction.atomic():
+            self.create_rows(options['rows'])
+            for serializer_class, model in ((PackageSerializer, Package),
+                                            (BookingSerializer, Booking)):
+                self.compare(serializer_class, model, options['repeat'])
+            transaction.set_rollback(True)
+
+    def create_rows(self, count):
+        packages = Package.objects.bulk_create(
+            Package(category='benchmark', name='Package {}'.format(i),
+                    promo='Promo', price=i * 1.5, rating='medium',
+                    tour_length=i % 20)
+            for i in range(count)
+        )
+        Booking.objects.bulk_create(
+            Booking(package=package, start=timezone.now().date(),
+                    name='Booking {}'.format(i),
+                    email_address='benchmark@localhost')
+            for i, package in enumerate(packages)
+        )
+
+    def compare(self, serializer_class, model, repeat):
+        queryset = model.objects.order_by('id')
+        names, to_representation = compile_values_serializer(serializer_class)
+        objects, rows = list(queryset), list(queryset.values(*names))
+
+        if list(map(dict, serializer_class(objects, many=True).data)) != \
+                [to_representation(row) for row in rows]:
+            raise CommandError(
+                'The outputs of {} differ.'.format(serializer_class.__name__))
+
+        cases = (
+            ('query and serialize', (
+                lambda: serializer_class(list(queryset), many=True).data,
+                lambda: [to_representation(row)
+                         for row in queryset.values(*names)],
+            )),
+            ('serialize only', (
+                lambda: serializer_class(objects, many=True).data,
+                lambda: [to_representation(row) for row in rows],
+            )),
+        )
+        for label, (instances, values) in cases:
+            slow = min(timeit.repeat(instances, number=1, repeat=repeat))
+            fast = min(timeit.repeat(values, number=1, repeat=repeat))
+            self.stdout.write(
+                '{} ({}): {:.1f} ms with instances, {:.1f} ms with '
+                'values(), {:.1f}x faster'.format(
+                    model.__name__, label, slow * 1000, fast * 1000,
+                    slow / fast))
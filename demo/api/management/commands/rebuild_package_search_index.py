@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of packages.'
+
+    def handle(self, *args, **options):
+        del args, options
+        if not search.fts_available():
+            raise CommandError(
+                'The package search index requires SQLite with FTS5.')
+        with transaction.atomic():
+            search.create_index()
+            search.rebuild_index()
+        self.stdout.write('Rebuilt the package search index.')
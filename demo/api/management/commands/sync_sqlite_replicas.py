@@ -0,0 +1,38 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from demo.db import mark_replica_synced
+
+
+class Command(BaseCommand):
+    help = ('Copies the primary SQLite database to the replicas of '
+            'DATABASE_REPLICAS with the SQLite online backup API.')
+
+    def handle(self, *args, **options):
+        del args, options
+        primary = settings.DATABASES[DEFAULT_DB_ALIAS]
+        replicas = [settings.DATABASES[alias]
+                    for alias in settings.DATABASE_REPLICAS]
+        if any('sqlite3' not in db['ENGINE'] for db in [primary] + replicas):
+            raise CommandError('Replicas can only be synced between SQLite '
+                               'databases.')
+
+        source = sqlite3.connect(primary['NAME'])
+        try:
+            for alias, replica in zip(settings.DATABASE_REPLICAS, replicas):
+                target = sqlite3.connect(
+                    replica['NAME'], timeout=settings.SQLITE_BUSY_TIMEOUT / 1000)
+                started_at = time.time()
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                mark_replica_synced(alias, started_at)
+                self.stdout.write('Synced {} ({}).'.format(
+                    alias, replica['NAME']))
+        finally:
+            source.close()
@@ -0,0 +1,18 @@
+from django.conf import settings
+
+from api.models import buffered_activity_log
+
+
+class ActivityLogBufferMiddleware:
+    """
+    Buffers the ActivityLog rows recorded while handling a request so
+    they are written with one bulk insert instead of one INSERT each.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with buffered_activity_log(
+                async_flush=settings.ACTIVITY_LOG_ASYNC_FLUSH):
+            return self.get_response(request)
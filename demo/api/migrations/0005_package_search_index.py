@@ -0,0 +1,26 @@
+from django.db import migrations
+
+from api import search
+
+
+def create_search_index(apps, schema_editor):
+    del apps
+    if search.fts_available(schema_editor.connection):
+        search.create_index(schema_editor.connection)
+        search.rebuild_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    del apps
+    if search.fts_available(schema_editor.connection):
+        search.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('api', '0004_dataexportjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
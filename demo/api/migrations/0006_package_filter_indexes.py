@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_package_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['-price', 'id'], name='api_package_price_desc_id'),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['category', 'price'], name='api_package_category_price'),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['rating', 'price'], name='api_package_rating_price'),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['start', 'price'], name='api_package_start_price'),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['tour_length', 'price'], name='api_package_tour_length_price'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+import re
+import zlib
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+CLASS_REPR = re.compile(r"^<class '(\w+)\.models\.(\w+)'>$")
+
+
+def compress_archive(apps, schema_editor):
+    DeletedData = apps.get_model('api', 'DeletedData')
+    for entry in DeletedData.objects.iterator():
+        match = CLASS_REPR.match(entry.model_type)
+        if match:
+            entry.model_type = '{}.{}'.format(
+                match.group(1), match.group(2).lower())
+        entry.payload = zlib.compress(entry.data.encode('utf8'))
+        entry.save(update_fields=['model_type', 'payload'])
+
+
+def decompress_archive(apps, schema_editor):
+    DeletedData = apps.get_model('api', 'DeletedData')
+    for entry in DeletedData.objects.iterator():
+        app_label, model_name = entry.model_type.split('.')
+        entry.model_type = "<class '{}.models.{}'>".format(
+            app_label, apps.get_model(app_label, model_name).__name__)
+        entry.data = zlib.decompress(entry.payload).decode('utf8')
+        entry.save(update_fields=['model_type', 'data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deleteddata',
+            name='payload',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='deleteddata',
+            name='archived_at',
+            field=models.DateTimeField(
+                auto_now_add=True, db_index=True,
+                default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='deleteddata',
+            name='data',
+            field=models.TextField(default=''),
+        ),
+        migrations.RunPython(compress_archive, decompress_archive),
+        migrations.RemoveField(
+            model_name='deleteddata',
+            name='data',
+        ),
+        migrations.AlterField(
+            model_name='deleteddata',
+            name='model_id',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='deleteddata',
+            index=models.Index(
+                fields=['model_type', 'model_id'],
+                name='api_deleteddata_model'),
+        ),
+    ]
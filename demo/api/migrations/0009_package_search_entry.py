@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:45
+
+import api.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_deleteddata_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackageSearchEntry',
+            fields=[
+                ('package', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='api.package')),
+                ('name', models.TextField()),
+                ('promo', models.TextField()),
+                ('index', api.search.SearchIndexField(db_column='api_package_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'api_package_fts',
+                'managed': False,
+            },
+        ),
+    ]
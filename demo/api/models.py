@@ -1,19 +1,73 @@
-from django.db import models
-from django.contrib.auth.models import User
-from django.core.exceptions import ObjectDoesNotExist
+import os
+import threading
+import zlib
+from contextlib import contextmanager, suppress
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+from django.core.cache import cache
+from django.contrib.auth.models import User, Permission
+from django.contrib.contenttypes.models import ContentType
 from django.core import serializers
 from guardian.shortcuts import assign_perm
+from guardian.utils import get_user_obj_perms_model
 import django.utils.timezone
 
+from api.search import FTS_TABLE, SearchIndexField
+from api.utils import bump_model_version, on_commit_once
+
 
 def now():
     return django.utils.timezone.now().date()
 
 
 class DeletedData(models.Model):
+    """
+    Archive of deleted rows. `model_type` is the model label (e.g.
+    "api.booking") and `payload` the zlib-compressed serialized JSON.
+    """
     model_type = models.CharField(max_length=200)
-    model_id = models.IntegerField()
-    data = models.TextField()
+    model_id = models.BigIntegerField()
+    payload = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model_type', 'model_id'],
+                         name='api_deleteddata_model'),
+        ]
+
+    @property
+    def data(self):
+        return zlib.decompress(self.payload).decode('utf8')
+
+    @classmethod
+    def archive(cls, instances):
+        """
+        Stores a copy of every instance in one query, before deleting them.
+        """
+        return cls.objects.bulk_create(
+            cls(
+                model_type=instance._meta.label_lower,
+                model_id=instance.pk,
+                payload=zlib.compress(
+                    serializers.serialize('json', [instance]).encode('utf8')),
+            )
+            for instance in instances
+        )
+
+
+class PackageQuerySet(models.QuerySet):
+    def annotate_can_write(self, user):
+        """
+        Annotates every package with a `can_write` boolean telling whether
+        `user` owns it, computed by a subquery of the same query.
+        """
+        return self.annotate(can_write=models.Exists(
+            PackagePermission.objects.filter(
+                package=models.OuterRef('pk'), user=user, is_owner=True)
+        ))
 
 
 class Package(models.Model):
@@ -25,16 +79,56 @@ class Package(models.Model):
     rating = models.CharField(max_length=50)
     tour_length = models.IntegerField()
     start = models.DateField(default=now)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = PackageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-price', 'id'],
+                         name='api_package_price_desc_id'),
+            models.Index(fields=['category', 'price'],
+                         name='api_package_category_price'),
+            models.Index(fields=['rating', 'price'],
+                         name='api_package_rating_price'),
+            models.Index(fields=['start', 'price'],
+                         name='api_package_start_price'),
+            models.Index(fields=['tour_length', 'price'],
+                         name='api_package_tour_length_price'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class PackageSearchEntry(models.Model):
+    """
+    Row of the full-text index of package names and promos (see
+    `api.search`). The table is only created on SQLite and is written
+    with raw SQL, never through this model.
+    """
+    package = models.OneToOneField(
+        Package, primary_key=True, db_column='rowid', db_constraint=False,
+        on_delete=models.DO_NOTHING, related_name='search_entry')
+    name = models.TextField()
+    promo = models.TextField()
+    index = SearchIndexField(db_column=FTS_TABLE)
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = FTS_TABLE
+
+
+BOOKING_OWNER_PERMISSIONS = ('change_booking', 'view_booking', 'delete_booking')
+
+
 class Booking(models.Model):
     package = models.ForeignKey(Package, null=True, on_delete=models.SET_NULL)
     start = models.DateField()
     name = models.CharField(max_length=200)
     email_address = models.CharField(max_length=200)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return '{} for {} on {}'.format(self.name, self.package.name, self.start)
@@ -51,35 +145,31 @@ class Booking(models.Model):
                 pass
 
         if created and user:
-            assign_perm('api.change_booking', user, self)
-            assign_perm('api.view_booking', user, self)
-            assign_perm('api.delete_booking', user, self)
+            for perm in BOOKING_OWNER_PERMISSIONS:
+                assign_perm('api.{}'.format(perm), user, self)
 
-            ActivityLog.objects.create(
+            ActivityLog.record(
                 user=user,
                 action=f'User #{user.id} "{user.email}" saved booking #{self.pk}'
             )
         elif not created and user:
-            ActivityLog.objects.create(
+            ActivityLog.record(
                 user=user,
                 action=f'User #{user.id} "{user.email}" updated booking #{self.pk}'
             )
         elif not created:
-            ActivityLog.objects.create(
+            ActivityLog.record(
                 user=None,
                 action=f'Booking #{self.pk} updated (email: {self.email_address})'
             )
 
     def delete(self, *args, **kwargs):
-        booking_data = serializers.serialize('json', [self])
-        DeletedData.objects.create(
-            model_type=Booking,
-            model_id=self.pk,
-            data=booking_data
-        )
+        DeletedData.archive([self])
         super().delete(*args, **kwargs)
 
 class PackagePermission(models.Model):
+    OWNED_PACKAGES_TIMEOUT = 3600
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     package = models.ForeignKey(Package, on_delete=models.CASCADE)
     is_owner = models.BooleanField(blank=False, default=True)
@@ -99,11 +189,54 @@ class PackagePermission(models.Model):
 
     @classmethod  # type: ignore
     def can_write(cls, user: User, package: 'Package') -> bool:
-        try:
-            permission = cls.objects.get(user=user, package=package)
-            return permission.is_owner
-        except ObjectDoesNotExist:
-            return False
+        return package.pk in cls.owned_package_ids(user)
+
+    @classmethod  # type: ignore
+    def can_write_many(cls, user: User, packages) -> set:
+        """
+        Returns the IDs of the given packages (instances or IDs) that
+        `user` can write to, with at most one query.
+        """
+        package_ids = {getattr(package, 'pk', package) for package in packages}
+        owned = cls.cached_owned_package_ids(user)
+        if owned is None:
+            return set(cls.objects.filter(
+                user=user, is_owner=True, package_id__in=package_ids,
+            ).values_list('package_id', flat=True))
+        return package_ids & owned
+
+    @staticmethod
+    def owned_packages_cache_key(user_id: int) -> str:
+        return '{}/owned_packages'.format(user_id)
+
+    @classmethod  # type: ignore
+    def owned_package_ids(cls, user: User) -> frozenset:
+        """
+        Returns the IDs of the packages that `user` owns.
+
+        The result is cached per user and dropped whenever a transaction
+        that saved or deleted one of the user's permissions commits.
+        """
+        package_ids = cls.cached_owned_package_ids(user)
+        if package_ids is None:
+            package_ids = frozenset(cls.objects.filter(
+                user=user, is_owner=True,
+            ).values_list('package_id', flat=True))
+            cache.set(cls.owned_packages_cache_key(user.id), package_ids,
+                      timeout=cls.OWNED_PACKAGES_TIMEOUT)
+        return package_ids
+
+    @classmethod  # type: ignore
+    def cached_owned_package_ids(cls, user: User):
+        """
+        Returns the cached owned package IDs of `user`, or None when the
+        cache is cold. Never touches the database.
+        """
+        return cache.get(cls.owned_packages_cache_key(user.id))
+
+    @classmethod  # type: ignore
+    def invalidate_owned_package_ids(cls, user_id: int) -> None:
+        cache.delete(cls.owned_packages_cache_key(user_id))
 
     @classmethod  # type: ignore
     def set_can_write(cls, user: User, package: 'Package') -> None:
@@ -118,18 +251,288 @@ class ActivityLog(models.Model):
     user = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
     action = models.CharField(max_length=300)
 
+    @classmethod  # type: ignore
+    def record(cls, user, action: str) -> None:
+        """
+        Logs `action` for `user`. Inside `buffered_activity_log()` the row
+        is queued and written with the rest of the buffer, otherwise it is
+        inserted right away.
+        """
+        buffers = getattr(_activity_log_buffers, 'stack', None)
+        if not buffers:
+            cls.objects.create(user=user, action=action)
+            return
+        buffers[-1].add(cls(user=user, action=action))
+
+
+_activity_log_buffers = threading.local()
+
+
+class ActivityLogBuffer:
+    """
+    Queues ActivityLog rows and writes them with a single bulk_create.
+
+    The buffer is flushed when the transaction that queued a row commits
+    and, for anything left over (e.g. rows queued in a transaction that
+    was rolled back), when the buffer is closed. Rows are written in the
+    order they were recorded.
+    """
+
+    def __init__(self, async_flush=False):
+        self.async_flush = async_flush
+        self.entries = []
+
+    def add(self, entry: ActivityLog) -> None:
+        self.entries.append(entry)
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(self.flush)
+
+    def flush(self) -> None:
+        entries, self.entries = self.entries, []
+        if not entries:
+            return
+        if self.async_flush:
+            from api.tasks import write_activity_logs
+            write_activity_logs.delay(
+                [(entry.user_id, entry.action) for entry in entries])
+        else:
+            ActivityLog.objects.bulk_create(entries)
+
+
+@contextmanager
+def buffered_activity_log(async_flush=False):
+    """
+    Buffers the ActivityLog rows recorded inside the block. With
+    `async_flush`, the rows are handed to a Celery task instead of being
+    written by the current process.
+    """
+    buffer = ActivityLogBuffer(async_flush=async_flush)
+    if not hasattr(_activity_log_buffers, 'stack'):
+        _activity_log_buffers.stack = []
+    _activity_log_buffers.stack.append(buffer)
+    try:
+        yield buffer
+    finally:
+        _activity_log_buffers.stack.pop()
+        buffer.flush()
+
+
+class DataExportJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+    ACTIVE_STATUSES = (PENDING, RUNNING)
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    file_path = models.CharField(max_length=500, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='unique_active_export'),
+        ]
+
+    @classmethod  # type: ignore
+    def get_or_start(cls, user: User):
+        """
+        Returns `(job, created)`, reusing the user's pending or running
+        export job when there is one. Jobs that stayed active for longer
+        than `USER_DATA_EXPORT_TIMEOUT` seconds are marked as failed.
+        """
+        stale_before = django.utils.timezone.now() - timedelta(
+            seconds=settings.USER_DATA_EXPORT_TIMEOUT)
+        cls.objects.filter(
+            user=user, status__in=cls.ACTIVE_STATUSES,
+            created_at__lt=stale_before,
+        ).update(status=cls.FAILED)
+
+        active = cls.objects.filter(
+            user=user, status__in=cls.ACTIVE_STATUSES).first()
+        if active is not None:
+            return active, False
+        try:
+            with transaction.atomic():
+                return cls.objects.create(user=user), True
+        except IntegrityError:
+            return cls.objects.get(
+                user=user, status__in=cls.ACTIVE_STATUSES), False
+
+    @classmethod  # type: ignore
+    def purge(cls, older_than) -> int:
+        """
+        Deletes the jobs that finished more than `older_than` (a timedelta)
+        ago and their export files. Returns the number of deleted jobs.
+        """
+        cutoff = django.utils.timezone.now() - older_than
+        jobs = cls.objects.filter(finished_at__lt=cutoff)
+        for path in jobs.exclude(file_path='').values_list(
+                'file_path', flat=True).iterator():
+            with suppress(FileNotFoundError):
+                os.remove(path)
+        return jobs.delete()[0]
+
+
+def restore_bookings(booking_ids):
+    """
+    Restores the deleted bookings with the given IDs from DeletedData in
+    one transaction, logging every restore in the ActivityLog. Nothing is
+    restored if any of them is missing.
+    """
+    booking_ids = set(booking_ids)
+    with transaction.atomic():
+        entries = DeletedData.objects.select_for_update().filter(
+            model_type=Booking._meta.label_lower,
+            model_id__in=booking_ids,
+        ).order_by('id')
+        latest = {entry.model_id: entry for entry in entries}
+        missing = booking_ids - latest.keys()
+        if missing:
+            raise ValueError('No deleted booking found with ID {}'.format(
+                ', '.join(str(pk) for pk in sorted(missing))))
+
+        bookings = [
+            deserialized.object
+            for entry in latest.values()
+            for deserialized in serializers.deserialize('json', entry.data)
+        ]
+        Booking.objects.bulk_create(bookings)
+        DeletedData.objects.filter(
+            model_type=Booking._meta.label_lower,
+            model_id__in=booking_ids,
+        ).delete()
+
+        emails = {booking.email_address for booking in bookings
+                  if booking.email_address}
+        users = {
+            user.email: user
+            for user in User.objects.filter(email__in=emails).order_by('-id')
+        }
+        logs = []
+        for booking in bookings:
+            user = users.get(booking.email_address)
+            if user is None:
+                action = f'Booking #{booking.pk} restored (email: {booking.email_address})'
+            else:
+                action = f'User #{user.id} "{user.email}" restored booking #{booking.pk}'
+            logs.append(ActivityLog(user=user, action=action))
+        ActivityLog.objects.bulk_create(logs)
+    bump_model_version(Booking)
+    return bookings
+
 
 def restore_booking(booking_id: int) -> None:
     """Restore a deleted booking from DeletedData"""
-    try:
-        deleted_data = DeletedData.objects.get(
-            model_type=Booking,
-            model_id=booking_id
-        )
+    restore_bookings([booking_id])
+
+
+def purge_deleted_data(older_than, batch_size=1000):
+    """
+    Deletes archive entries stored more than `older_than` (a timedelta)
+    ago, `batch_size` rows per query so the table is never locked for
+    long. Returns the number of deleted entries.
+    """
+    cutoff = django.utils.timezone.now() - older_than
+    purged = 0
+    while True:
+        ids = list(DeletedData.objects.filter(archived_at__lt=cutoff)
+                   .order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return purged
+        purged += DeletedData.objects.filter(id__in=ids).delete()[0]
 
-        for instance in serializers.deserialize('json', deleted_data.data):
-            instance.save()
-            deleted_data.delete()
 
-    except DeletedData.DoesNotExist:
-        raise ValueError(f"No deleted booking found with ID {booking_id}")
+def delete_bookings(bookings):
+    """
+    Archives and deletes `bookings` in one transaction, with a single
+    INSERT into DeletedData and a single DELETE instead of a pair of
+    queries per booking.
+    """
+    with transaction.atomic():
+        DeletedData.archive(bookings)
+        Booking.objects.filter(
+            pk__in=[booking.pk for booking in bookings]).delete()
+
+
+def bulk_create_bookings(rows, batch_size=500):
+    """
+    Creates bookings from validated `rows` the way `Booking.save` does,
+    but with a constant number of queries per batch: the users are looked
+    up by email in one query, and the bookings, their owner object
+    permissions and the activity log rows are inserted with bulk_create.
+    """
+    emails = {row['email_address'] for row in rows if row.get('email_address')}
+    users = {
+        user.email: user
+        for user in User.objects.filter(email__in=emails).order_by('-id')
+    }
+    user_object_permission = get_user_obj_perms_model()
+    content_type = ContentType.objects.get_for_model(Booking)
+
+    with transaction.atomic():
+        permissions = list(Permission.objects.filter(
+            content_type=content_type,
+            codename__in=BOOKING_OWNER_PERMISSIONS,
+        ))
+        bookings = Booking.objects.bulk_create(
+            [Booking(**row) for row in rows], batch_size=batch_size)
+
+        object_permissions, logs = [], []
+        for booking in bookings:
+            user = users.get(booking.email_address)
+            if user is None:
+                continue
+            object_permissions.extend(
+                user_object_permission(
+                    user=user,
+                    permission=permission,
+                    content_type=content_type,
+                    object_pk=str(booking.pk),
+                )
+                for permission in permissions
+            )
+            logs.append(ActivityLog(
+                user=user,
+                action=f'User #{user.id} "{user.email}" saved booking #{booking.pk}'
+            ))
+        user_object_permission.objects.bulk_create(
+            object_permissions, batch_size=batch_size)
+        ActivityLog.objects.bulk_create(logs, batch_size=batch_size)
+    return bookings
+
+
+def bulk_create_packages(owner, rows, batch_size=500):
+    """
+    Creates packages from validated `rows` owned by `owner`, inserting the
+    packages and their owner PackagePermission rows with bulk_create and
+    adding them to the search index, in one transaction.
+    """
+    from api.search import index_packages
+
+    with transaction.atomic():
+        packages = Package.objects.bulk_create(
+            [Package(**row) for row in rows], batch_size=batch_size)
+        PackagePermission.objects.bulk_create(
+            [PackagePermission(user=owner, package=package, is_owner=True)
+             for package in packages],
+            batch_size=batch_size,
+        )
+        index_packages(packages)
+        on_commit_once(
+            PackagePermission.owned_packages_cache_key(owner.id),
+            lambda: PackagePermission.invalidate_owned_package_ids(owner.id))
+    bump_model_version(Package)
+    bump_model_version(PackagePermission)
+    return packages
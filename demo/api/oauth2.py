@@ -0,0 +1,113 @@
+import hashlib
+import threading
+
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.http import parse_header_parameters
+from oauth2_provider.models import get_access_token_model
+from oauth2_provider.oauth2_backends import JSONOAuthLibCore
+from oauth2_provider.oauth2_validators import OAuth2Validator
+from oauthlib.common import urlencode
+
+# The only token fields kept in the cache: no secrets, and no user or
+# application data
+CACHED_TOKEN_FIELDS = ('id', 'user_id', 'application_id', 'scope', 'expires')
+
+# Bodies that may carry the access token of a resource request
+FORM_CONTENT_TYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+_request_tokens = threading.local()
+
+
+def access_token_cache_key(token):
+    return 'oauth2_token/{}'.format(hashlib.sha256(token.encode()).hexdigest())
+
+
+def start_request_memo(**kwargs):
+    del kwargs
+    _request_tokens.tokens = {}
+
+
+def clear_request_memo(**kwargs):
+    del kwargs
+    _request_tokens.tokens = None
+
+
+def invalidate_access_tokens(*tokens):
+    """
+    Drops `tokens` from the cache and from the current request's memo.
+    """
+    cache.delete_many([access_token_cache_key(token) for token in tokens])
+    memo = getattr(_request_tokens, 'tokens', None)
+    if memo:
+        for token in tokens:
+            memo.pop(token, None)
+
+
+def rebuild_access_token(token, fields):
+    """
+    Returns an AccessToken with only `token` and the cached `fields`
+    loaded. The other fields are deferred, and the user and application
+    are fetched by primary key when first accessed.
+    """
+    model = get_access_token_model()
+    fields = dict(fields, token=token)
+    return model.from_db(model.objects.db, list(fields), [
+        fields[field.attname] for field in model._meta.concrete_fields
+        if field.attname in fields
+    ])
+
+
+class CachedOAuth2Validator(OAuth2Validator):
+    """
+    OAuth2 validator that caches the user id, application id, scope and
+    expiry of access tokens for their remaining lifetime.
+
+    Within a request the token is also remembered, so the middleware and
+    the DRF authentication share one lookup. Saving or deleting a token
+    drops it from the cache (see `ApiConfig.ready`), so revocations and
+    scope changes apply at once.
+    """
+
+    def _load_access_token(self, token):
+        memo = getattr(_request_tokens, 'tokens', None)
+        if memo is not None and token in memo:
+            return memo[token]
+
+        key = access_token_cache_key(token)
+        fields = cache.get(key)
+        if fields is not None:
+            access_token = rebuild_access_token(token, fields)
+        else:
+            access_token = super()._load_access_token(token)
+            if access_token is not None and access_token.expires:
+                lifetime = access_token.expires - timezone.now()
+                if lifetime.total_seconds() >= 1:
+                    cache.set(key, {
+                        name: getattr(access_token, name)
+                        for name in CACHED_TOKEN_FIELDS
+                    }, timeout=int(lifetime.total_seconds()))
+
+        if memo is not None:
+            memo[token] = access_token
+        return access_token
+
+
+class ResourceOAuthLibCore(JSONOAuthLibCore):
+    """
+    OAuth backend that only reads the body of resource requests when it
+    is a form, which may carry the access token. JSON and NDJSON bodies
+    are left to the view, so verifying the token of an upload neither
+    loads nor parses it, nor fails it over DATA_UPLOAD_MAX_MEMORY_SIZE.
+    The token endpoints still accept JSON bodies.
+    """
+
+    def verify_request(self, request, scopes):
+        content_type, _ = parse_header_parameters(
+            request.META.get('CONTENT_TYPE', ''))
+        body = ''
+        if content_type in FORM_CONTENT_TYPES:
+            body = urlencode(request.POST.items())
+        return self.server.verify_request(
+            self._get_escaped_full_path(request), request.method, body,
+            self.extract_headers(request), scopes=scopes)
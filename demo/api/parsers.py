@@ -0,0 +1,88 @@
+import codecs
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+def iter_ndjson(stream, encoding='utf-8'):
+    """
+    Yields the JSON values of a newline-delimited JSON stream, one line
+    at a time. Blank lines are skipped.
+    """
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line.decode(encoding))
+        except ValueError as exc:
+            raise ParseError(
+                'NDJSON parse error on line {}: {}'.format(line_number, exc))
+
+
+def iter_json_array(stream, encoding='utf-8', chunk_size=64 * 1024):
+    """
+    Yields the items of a JSON array read from `stream` in chunks of
+    `chunk_size` bytes, so only the item being decoded is kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    buffer, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + text_decoder.decode(chunk, final=eof)
+        pos = 0
+
+    def next_char():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos] if pos < len(buffer) else ''
+            fill()
+
+    if next_char() != '[':
+        raise ParseError('JSON parse error: expected an array.')
+    pos += 1
+    if next_char() == ']':
+        return
+    while True:
+        next_char()
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except ValueError as exc:
+            if eof:
+                raise ParseError('JSON parse error: {}'.format(exc))
+            fill()
+            continue
+        if end == len(buffer) and not eof:
+            # A number may continue in the next chunk
+            fill()
+            continue
+        pos = end
+        yield item
+        separator = next_char()
+        pos += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ParseError(
+                'JSON parse error: expected "," or "]" after item.')
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON into a list.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return list(iter_ndjson(stream, encoding))
@@ -0,0 +1,114 @@
+"""
+Full-text search over package names and promos.
+
+On SQLite the index is the FTS5 table `api_package_fts`, which keeps a
+copy of the `name` and `promo` of every package with the package ID as
+its rowid. It is mapped by the unmanaged `PackageSearchEntry` model so
+queries can join it. Signals keep it in sync with `Package` writes and
+the `rebuild_package_search_index` command rebuilds it from scratch.
+Other databases fall back to case-insensitive substring matching.
+"""
+from django.db import connection
+from django.db.models import F, Lookup, Q, TextField
+
+FTS_TABLE = 'api_package_fts'
+
+
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return '{} MATCH {}'.format(lhs, rhs), lhs_params + rhs_params
+
+
+class SearchIndexField(TextField):
+    """
+    The hidden column of an FTS5 table that has the table's name. Filter
+    on it with `__match` to run a full-text query.
+    """
+
+
+SearchIndexField.register_lookup(Match)
+
+
+def fts_available(schema_connection=None):
+    return (schema_connection or connection).vendor == 'sqlite'
+
+
+def create_index(schema_connection=None):
+    schema_connection = schema_connection or connection
+    with schema_connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5(name, promo)'.format(
+                FTS_TABLE))
+
+
+def drop_index(schema_connection=None):
+    schema_connection = schema_connection or connection
+    with schema_connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS {}'.format(FTS_TABLE))
+
+
+def rebuild_index(schema_connection=None):
+    schema_connection = schema_connection or connection
+    with schema_connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {}'.format(FTS_TABLE))
+        cursor.execute(
+            'INSERT INTO {}(rowid, name, promo) '
+            'SELECT id, name, promo FROM api_package'.format(FTS_TABLE))
+
+
+def index_packages(packages):
+    if not fts_available():
+        return
+    packages = list(packages)
+    unindex_packages(package.pk for package in packages)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO {}(rowid, name, promo) VALUES (%s, %s, %s)'.format(
+                FTS_TABLE),
+            [(package.pk, package.name, package.promo) for package in packages]
+        )
+
+
+def unindex_packages(package_ids):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            'DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE),
+            [(package_id,) for package_id in package_ids]
+        )
+
+
+def match_expression(terms):
+    """
+    Builds an FTS5 query matching rows that contain every term, each
+    treated as a quoted prefix so user input cannot inject FTS syntax.
+    """
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def search_packages(queryset, query):
+    """
+    Filters `queryset` down to the packages matching the words of `query`,
+    best matches first.
+    """
+    terms = query.split()
+    if not terms:
+        return queryset
+
+    if not fts_available():
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term) | Q(promo__icontains=term))
+        return queryset
+
+    # One MATCH over the joined index; its `rank` column is bm25()
+    return queryset.filter(
+        search_entry__index__match=match_expression(terms)
+    ).annotate(
+        search_rank=F('search_entry__rank')
+    ).order_by('search_rank', 'id')
@@ -1,15 +1,164 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
 from rest_framework import serializers
 
-from api.models import Package, Booking
+from api.models import Package, Booking, DataExportJob
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field that can resolve the related objects of many rows
+    with one query, see `prefetch`.
+    """
+    prefetched = None
+
+    def prefetch(self, values):
+        pks = set()
+        for value in values:
+            try:
+                pks.add(self.get_queryset().model._meta.pk.to_python(value))
+            except (TypeError, ValueError, DjangoValidationError):
+                pass
+        self.prefetched = self.get_queryset().in_bulk(pks)
+
+    def to_internal_value(self, data):
+        if self.prefetched is None or isinstance(data, bool):
+            return super().to_internal_value(data)
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+            return self.prefetched[pk]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+def validate_rows(serializer_class, rows):
+    """
+    Validates `rows` with a list serializer of `serializer_class`.
+
+    Returns `(validated_data, errors)` where `errors` holds a
+    `{'row': index, 'errors': ...}` entry for every invalid row, so the
+    valid rows can still be saved.
+    """
+    serializer = serializer_class(data=rows, many=True)
+    for field in serializer.child.fields.values():
+        if isinstance(field, BulkPrimaryKeyRelatedField):
+            field.prefetch(
+                row.get(field.field_name) for row in rows
+                if isinstance(row, dict)
+            )
+    if serializer.is_valid():
+        return serializer.validated_data, []
+
+    validated_data, errors = [], []
+    for index, (row, row_errors) in enumerate(zip(rows, serializer.errors)):
+        if row_errors:
+            errors.append({'row': index, 'errors': row_errors})
+        else:
+            validated_data.append(serializer.child.run_validation(row))
+    return validated_data, errors
+
+
+# Serializer fields whose representation of a value read from a model
+# field of the given internal types is the value itself
+PASSTHROUGH_FIELDS = {
+    serializers.CharField: {'CharField', 'TextField', 'EmailField'},
+    serializers.EmailField: {'CharField', 'EmailField'},
+    serializers.IntegerField: {
+        'AutoField', 'BigAutoField', 'IntegerField', 'BigIntegerField',
+        'SmallIntegerField', 'PositiveIntegerField'},
+    serializers.FloatField: {'FloatField'},
+    serializers.BooleanField: {'BooleanField'},
+}
+
+
+def is_passthrough(field, model):
+    try:
+        model_field = model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        return False
+    return model_field.get_internal_type() in PASSTHROUGH_FIELDS.get(
+        type(field), ())
+
+
+@lru_cache(maxsize=None)
+def compile_values_serializer(serializer_class):
+    """
+    Precompiles how `serializer_class` represents a row of `.values()`.
+
+    Returns `(names, to_representation)`: the names to pass to `values()`
+    and a function turning one of its rows into the same data the
+    serializer builds from a model instance. Returns None if a field
+    cannot be read from a flat row (nested serializers, method fields,
+    dotted sources).
+    """
+    model = serializer_class.Meta.model
+    columns = []
+    for field in serializer_class().fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*' or '.' in field.source:
+            return None
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            # values() already holds the primary key of the related row
+            convert = field.pk_field.to_representation \
+                if field.pk_field else None
+        elif isinstance(field, (serializers.RelatedField,
+                                serializers.ManyRelatedField,
+                                serializers.BaseSerializer,
+                                serializers.SerializerMethodField)):
+            return None
+        elif is_passthrough(field, model):
+            convert = None
+        else:
+            convert = field.to_representation
+        columns.append((field.field_name, field.source, convert))
+
+    def to_representation(row):
+        data = {}
+        for name, source, convert in columns:
+            value = row[source]
+            if value is not None and convert is not None:
+                value = convert(value)
+            data[name] = value
+        return data
+
+    return tuple(source for _, source, _ in columns), to_representation
 
 
 class PackageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Package
-        fields = '__all__'
+        exclude = ('updated_at',)
+
+
+class PackageWriteAccessSerializer(PackageSerializer):
+    """
+    Package serializer with the `can_write` flag of a queryset annotated
+    by `annotate_can_write`.
+    """
+    can_write = serializers.BooleanField(read_only=True)
+
+    class Meta(PackageSerializer.Meta):
+        pass
 
 
 class BookingSerializer(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
+
     class Meta:
         model = Booking
-        fields = '__all__'
+        exclude = ('updated_at',)
+
+
+class BookingIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False)
+
+
+class DataExportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DataExportJob
+        fields = ('id', 'status', 'created_at', 'finished_at')
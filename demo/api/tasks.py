@@ -0,0 +1,73 @@
+import csv
+import gzip
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from demo.cache import AtomicDatabaseCache
+from demo.celery import app
+
+from api.models import ActivityLog, DataExportJob, purge_deleted_data
+from api.utils import user_data_rows
+
+
+@app.task
+def export_user_data(job_id):
+    job = DataExportJob.objects.select_related('user').get(id=job_id)
+    job.status = DataExportJob.RUNNING
+    job.save(update_fields=['status'])
+
+    os.makedirs(settings.USER_DATA_EXPORT_ROOT, exist_ok=True)
+    path = os.path.join(
+        settings.USER_DATA_EXPORT_ROOT,
+        'user-{}-export-{}.csv.gz'.format(job.user_id, job.id),
+    )
+    partial_path = path + '.part'
+    try:
+        with gzip.open(partial_path, 'wt', encoding='utf8', newline='') as f:
+            writer = csv.writer(f, dialect='unix')
+            writer.writerows(user_data_rows(job.user))
+        os.replace(partial_path, path)
+    except Exception:
+        job.status = DataExportJob.FAILED
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'finished_at'])
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    job.status = DataExportJob.DONE
+    job.file_path = path
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'file_path', 'finished_at'])
+
+
+@app.task
+def write_activity_logs(entries):
+    ActivityLog.objects.bulk_create(
+        ActivityLog(user_id=user_id, action=action)
+        for user_id, action in entries
+    )
+
+
+@app.task
+def purge_deleted_data_archive():
+    return purge_deleted_data(
+        timedelta(days=settings.DELETED_DATA_RETENTION_DAYS))
+
+
+@app.task
+def purge_user_data_exports():
+    return DataExportJob.purge(
+        timedelta(days=settings.USER_DATA_EXPORT_RETENTION_DAYS))
+
+
+@app.task
+def purge_expired_cache_entries():
+    shared = caches['shared']
+    if not isinstance(shared, AtomicDatabaseCache):
+        return 0
+    return shared.purge_expired()
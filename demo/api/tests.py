@@ -1,13 +1,53 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
 from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
 from rest_framework.test import APITestCase
 from django.contrib.auth.models import User, Group
+from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
-from api.models import Package, PackagePermission, Booking, DeletedData, restore_booking
-from api.utils import create_access_token, auth_header
-from api.utils import group_has_perm, user_has_group_perm
+from django.utils.http import http_date
+from api.models import Package, PackagePermission, Booking, DeletedData, DataExportJob, restore_booking, restore_bookings, purge_deleted_data
+from api.models import ActivityLog, buffered_activity_log
+from api.tasks import export_user_data
+from api.views import BookingViewSet, PackageBulkCreateView, PackageViewSet, PublicPackageViewSet
+from demo.cache import INVALIDATION_SEQ_KEY, AtomicDatabaseCache, TwoTierCache
+from demo.db import ReadReplicaRouter, ReplicaStickinessMiddleware, mark_replica_synced, replica_reads
+from demo.throttling import SlidingWindow, parse_rate
+from api.utils import create_access_token, auth_header, capture_model_queries, model_version
+from api.utils import group_has_perm, user_has_group_perm, objects_with_group_perm
 from typing import Any
 
 
+class ConstantQueriesMixin:
+    def assertConstantQueries(self, run, prepare=lambda count: count,
+                              counts=(2, 20)):
+        """
+        Checks that `run(prepare(count))` makes the same number of
+        queries, on-commit hooks included, for each of `counts`. A first
+        run with a count of 1 warms up the caches it uses (access tokens,
+        throttles, model versions) and is not compared.
+        """
+        query_counts = []
+        for count in (1,) + tuple(counts):
+            arg = prepare(count)
+            with CaptureQueriesContext(connection) as queries:
+                with self.captureOnCommitCallbacks(execute=True):
+                    run(arg)
+            query_counts.append(len(queries))
+        self.assertEqual(len(set(query_counts[1:])), 1, query_counts)
+
+
 class PackageViewSetTestCase(APITestCase):
     def test_only_logged_in_users_can_view_packages(self):
         response = self.client.get('/api/v1/packages/')
@@ -30,6 +70,7 @@ class PackageViewSetTestCase(APITestCase):
 
 class PackagePermissionTestCase(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create(username='user')
         self.auth_user = auth_header(create_access_token(self.user))
         self.package = Package.objects.create(
@@ -47,6 +88,89 @@ class PackagePermissionTestCase(APITestCase):
         self.assertFalse(PackagePermission.can_write(
             self.user, self.other_package))
 
+    def test_owned_package_ids_are_cached_and_invalidated(self):
+        self.assertEqual(
+            PackagePermission.owned_package_ids(self.user), {self.package.id})
+        with capture_model_queries() as queries:
+            self.assertTrue(PackagePermission.can_write(
+                self.user, self.package))
+
+        self.assertEqual(len(queries), 0, queries)
+        with self.captureOnCommitCallbacks(execute=True):
+            PackagePermission.set_can_write(self.user, self.other_package)
+        self.assertIsNone(
+            PackagePermission.cached_owned_package_ids(self.user))
+        self.assertTrue(PackagePermission.can_write(
+            self.user, self.other_package))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PackagePermission.objects.filter(
+                user=self.user, package=self.other_package).delete()
+        self.assertFalse(PackagePermission.can_write(
+            self.user, self.other_package))
+
+    def test_owned_package_ids_are_invalidated_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            PackagePermission.objects.filter(
+                user=self.user, package=self.package).delete()
+            # A concurrent request caches the IDs before the commit
+            cache.set(PackagePermission.owned_packages_cache_key(self.user.id),
+                      frozenset({self.package.id}))
+        self.assertIsNone(
+            PackagePermission.cached_owned_package_ids(self.user))
+        response = self.client.get(
+            '/api/v1/packages/{}/'.format(self.package.id), **self.auth_user)
+        self.assertEqual(response.status_code, 404)
+
+    def test_can_write_many(self):
+        packages = [self.package, self.other_package]
+        with capture_model_queries() as queries:
+            self.assertEqual(
+                PackagePermission.can_write_many(self.user, packages),
+                {self.package.id}
+            )
+        self.assertEqual(len(queries), 1, queries)
+        PackagePermission.owned_package_ids(self.user)
+        with capture_model_queries() as queries:
+            self.assertEqual(
+                PackagePermission.can_write_many(
+                    self.user, [package.id for package in packages]),
+                {self.package.id}
+            )
+
+        self.assertEqual(len(queries), 0, queries)
+    def test_annotate_can_write(self):
+        with self.assertNumQueries(1):
+            flags = dict(Package.objects.annotate_can_write(
+                self.other_user).values_list('id', 'can_write'))
+        self.assertEqual(
+            flags, {self.package.id: False, self.other_package.id: True})
+
+    def test_list_flags_write_access(self):
+        admin = User.objects.create(username='admin')
+        PackagePermission.set_can_write(admin, self.other_package)
+        response = self.client.get(
+            '/api/v1/packages/', **auth_header(create_access_token(admin)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {package['id']: package['can_write']
+             for package in response.data['results']},  # type: ignore
+            {self.package.id: False, self.other_package.id: True}
+        )
+
+    def test_list_only_returns_owned_packages(self):
+        for warm_cache in (False, True):
+            self.assertEqual(
+                PackagePermission.cached_owned_package_ids(self.user),
+                {self.package.id} if warm_cache else None)
+            response = self.client.get('/api/v1/packages/', **self.auth_user)
+            self.assertEqual(response.status_code, 200)
+            response_data: Any = response.data  # type: ignore
+            self.assertEqual(
+                [package['id'] for package in response_data['results']],
+                [self.package.id]
+            )
+
     def test_user_cannot_access_other_users_packages(self):
         response = self.client.get(
             '/api/v1/packages/{}/'.format(self.package.id),
@@ -59,7 +183,7 @@ class PackagePermissionTestCase(APITestCase):
             response_data.keys(),
             [
                 'id', 'category', 'name', 'promo', 'price',
-                'tour_length', 'rating', 'start'
+                'tour_length', 'rating', 'start', 'can_write'
             ]
         )
 
@@ -78,6 +202,294 @@ class PackagePermissionTestCase(APITestCase):
         self.assertEqual(response_data_2['id'], self.other_package.id)
 
 
+class PublicPackageCursorPaginationTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(25):
+            Package.objects.create(
+                category='a', name='package {}'.format(i),
+                price=float(i % 4), rating='medium', tour_length=1)
+
+    def test_cursor_pagination_walks_catalog_once(self):
+        expected = list(Package.objects.order_by(
+            '-price', 'id').values_list('id', flat=True))
+        seen = []
+        url = '/api/v1/public/packages/?pagination=cursor'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertFalse(any(
+                'COUNT(' in query['sql'] for query in queries.captured_queries))
+            self.assertEqual(response.status_code, 200)
+            response_data: Any = response.data  # type: ignore
+            self.assertNotIn('count', response_data)
+            seen.extend(package['id'] for package in response_data['results'])
+            url = response_data['next']
+        self.assertEqual(seen, expected)
+
+    def test_tied_prices_use_no_offset(self):
+        Package.objects.update(price=1.0)
+        expected = list(Package.objects.order_by(
+            '-price', 'id').values_list('id', flat=True))
+        pages, url = [], '/api/v1/public/packages/?pagination=cursor'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any(
+                'OFFSET' in query['sql'] for query in queries.captured_queries))
+            response_data: Any = response.data  # type: ignore
+            pages.append([package['id'] for package in response_data['results']])
+            url, previous = response_data['next'], response_data['previous']
+        self.assertEqual(sum(pages, []), expected)
+
+        # And back from the last page
+        while previous:
+            response_data = self.client.get(previous).data  # type: ignore
+            pages.pop()
+            self.assertEqual(
+                [package['id'] for package in response_data['results']],
+                pages[-1])
+            previous = response_data['previous']
+        self.assertEqual(len(pages), 1)
+
+        # p=[1] and p=[{},1]
+        for cursor in ('cD1bMV0=', 'cD1be30sMV0='):
+            response = self.client.get(
+                '/api/v1/public/packages/',
+                {'pagination': 'cursor', 'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_page_number_pagination_is_default(self):
+        response = self.client.get('/api/v1/public/packages/?page=3')
+        self.assertEqual(response.status_code, 200)
+        response_data: Any = response.data  # type: ignore
+        self.assertEqual(response_data['count'], 25)
+        self.assertEqual(len(response_data['results']), 5)
+
+
+class PublicPackageSearchTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.beach = Package.objects.create(
+            category='a', name='Beach week', promo='Sun and sand',
+            price=1.0, rating='easy', tour_length=7)
+        self.hike = Package.objects.create(
+            category='a', name='Mountain hike', promo='Hike to the beach',
+            price=2.0, rating='hard', tour_length=3)
+        Package.objects.create(
+            category='a', name='City tour', promo='Museums',
+            price=3.0, rating='easy', tour_length=1)
+
+    def search(self, query):
+        response = self.client.get(
+            '/api/v1/public/packages/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        response_data: Any = response.data  # type: ignore
+        return [package['id'] for package in response_data['results']]
+
+    def test_search_ranks_matches(self):
+        self.assertEqual(self.search('beach'), [self.beach.id, self.hike.id])
+        self.assertEqual(self.search('moun'), [self.hike.id])
+        self.assertEqual(self.search('"museums OR'), [])
+
+    def test_index_follows_writes(self):
+        self.hike.name = 'Volcano trek'
+        self.hike.promo = 'Lava fields'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hike.save()
+        self.assertEqual(self.search('beach'), [self.beach.id])
+        self.assertEqual(self.search('volcano'), [self.hike.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.beach.delete()
+        self.assertEqual(self.search('beach'), [])
+
+    def test_single_match_in_subqueries(self):
+        from api.search import search_packages
+
+        queryset = search_packages(Package.objects.all(), 'beach')
+        self.assertEqual(str(queryset.query).count('MATCH'), 1)
+        # The rank still refers to the right row when the package table
+        # is re-aliased inside a subquery
+        self.assertEqual(
+            list(Package.objects.filter(id__in=queryset.filter(
+                search_rank__lt=0).values('id')).order_by('id')),
+            [self.beach, self.hike])
+
+
+class PackageFilterAndFacetsTestCase(APITestCase):
+    def setUp(self):
+        for category, rating, price, tour_length, start in (
+            ('beach', 'easy', 50.0, 3, '2024-01-10'),
+            ('beach', 'medium', 250.0, 7, '2024-02-10'),
+            ('mountain', 'hard', 800.0, 10, '2024-03-10'),
+            ('city', 'easy', 120.0, 2, '2024-04-10'),
+        ):
+            Package.objects.create(
+                category=category, name=category, promo='promo',
+                rating=rating, price=price, tour_length=tour_length,
+                start=start)
+
+    def names(self, params):
+        response = self.client.get('/api/v1/public/packages/', params)
+        self.assertEqual(response.status_code, 200)
+        response_data: Any = response.data  # type: ignore
+        return [(p['category'], p['price']) for p in response_data['results']]
+
+    def test_filters(self):
+        self.assertEqual(
+            self.names({'category': 'beach,city', 'price_max': 200}),
+            [('city', 120.0), ('beach', 50.0)])
+        self.assertEqual(
+            self.names({'tour_length_min': 5, 'rating': 'hard'}),
+            [('mountain', 800.0)])
+        self.assertEqual(
+            self.names({'start_after': '2024-02-01',
+                        'start_before': '2024-03-31'}),
+            [('mountain', 800.0), ('beach', 250.0)])
+
+    def test_facets_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                '/api/v1/public/packages/facets/', {'price_min': 100})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'count': 3,
+            'category': {'beach': 1, 'mountain': 1, 'city': 1},
+            'rating': {'easy': 1, 'medium': 1, 'hard': 1},
+            'price': {'100-500': 2, '500-1000': 1},
+            'tour_length': {'*-4': 1, '4-8': 1, '8-15': 1},
+        })
+
+
+class ConditionalGetTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.package = Package.objects.create(
+            category='a', name='package', price=1.0, rating='easy',
+            tour_length=1)
+
+    def test_list_not_modified(self):
+        response = self.client.get('/api/v1/public/packages/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertNotIn('Last-Modified', response)
+
+        response = self.client.get(
+            '/api/v1/public/packages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.package.price = 2.0
+        with self.captureOnCommitCallbacks(execute=True):
+            self.package.save()
+        response = self.client.get(
+            '/api/v1/public/packages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_delete_changes_list_etag(self):
+        other = Package.objects.create(
+            category='a', name='other', price=0.5, rating='easy',
+            tour_length=1)
+        etag = self.client.get('/api/v1/public/packages/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        response = self.client.get(
+            '/api/v1/public/packages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_not_modified(self):
+        url = '/api/v1/public/packages/{}/'.format(self.package.id)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('updated_at', response.json())
+
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/api/v1/public/packages/0/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_list_ignores_if_modified_since(self):
+        bookings = [
+            Booking.objects.create(
+                package=self.package, start=timezone.now().date(),
+                name='booking {}'.format(i), email_address='user@localhost')
+            for i in range(2)
+        ]
+        since = http_date(time.time())
+        with self.captureOnCommitCallbacks(execute=True):
+            bookings[1].delete()
+        response = self.client.get(
+            '/api/v1/bookings/', HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+
+    def test_booking_list_not_modified(self):
+        Booking.objects.create(
+            package=self.package, start='2024-01-01', name='booking',
+            email_address='user@localhost')
+        response = self.client.get('/api/v1/bookings/')
+        self.assertEqual(response.status_code, 200)
+        with capture_model_queries() as queries:
+            response = self.client.get(
+                '/api/v1/bookings/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(len(queries), 1, queries)
+        self.assertEqual(response.status_code, 304)
+
+
+class PublicPackageResponseCacheTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.package = Package.objects.create(
+            category='a', name='package', price=1.0, rating='easy',
+            tour_length=1)
+
+    def test_hits_skip_the_database(self):
+        url = '/api/v1/public/packages/?page=1'
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        with capture_model_queries() as queries:
+            cached = self.client.get(url)
+        self.assertEqual(len(queries), 0, queries)
+        self.assertEqual(cached['X-Cache'], 'HIT')
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+        with capture_model_queries() as queries:
+            not_modified = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(len(queries), 0, queries)
+        self.assertEqual(not_modified.status_code, 304)
+
+        from api.views import PublicPackageViewSet
+        self.assertEqual(
+            PublicPackageViewSet.response_cache_stats(),
+            {'hits': 2, 'misses': 1})
+
+    def test_package_write_invalidates(self):
+        url = '/api/v1/public/packages/{}/'.format(self.package.id)
+        self.client.get(url)
+        self.package.name = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.package.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['name'], 'renamed')
+
+    def test_version_changes_on_commit(self):
+        version = model_version(Package)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.package.save()
+            # A reader before the commit still sees the old version
+            self.assertEqual(model_version(Package), version)
+        self.assertNotEqual(model_version(Package), version)
+
+
 class ValidationTestCase(APITestCase):
     def test_invalid_start_date_returns_error(self):
         user = User.objects.create(username='user')
@@ -167,6 +579,176 @@ class BookingPerObjectPermissionTestCase(APITestCase):
         self.assertTrue(user_has_group_perm(self.other_user, perm, booking))
 
 
+class BookingBulkImportTestCase(ConstantQueriesMixin, APITestCase):
+    def setUp(self):
+        self.package = Package.objects.create(
+            category='a', name='package',
+            price=0.0, rating='medium', tour_length=1
+        )
+        self.user = User.objects.create(
+            username='user', email='user@localhost')
+
+    def rows(self, count):
+        return [
+            {
+                'package': self.package.id,
+                'start': '2024-01-01',
+                'name': 'Booking {}'.format(i),
+                'email_address': self.user.email,
+            }
+            for i in range(count)
+        ]
+
+    def test_import_json_array_reports_invalid_rows(self):
+        rows = self.rows(2)
+        rows.insert(1, {'name': 'No start date'})
+        response = self.client.post(
+            '/api/v1/bookings/import/', rows, format='json')
+        self.assertEqual(response.status_code, 201)
+        response_data: Any = response.data  # type: ignore
+        self.assertEqual(len(response_data['created']), 2)
+        self.assertEqual(
+            [error['row'] for error in response_data['errors']], [1])
+        self.assertIn('start', response_data['errors'][0]['errors'])
+
+        for booking in Booking.objects.all():
+            self.assertTrue(self.user.has_perm('api.change_booking', booking))
+            self.assertTrue(self.user.has_perm('api.delete_booking', booking))
+        self.assertEqual(ActivityLog.objects.filter(user=self.user).count(), 2)
+
+    def test_import_ndjson_in_constant_queries(self):
+        def run(count):
+            body = '\n'.join(json.dumps(row) for row in self.rows(count))
+            response = self.client.post(
+                '/api/v1/bookings/import/', body,
+                content_type='application/x-ndjson')
+            self.assertEqual(response.status_code, 201)
+
+        self.assertConstantQueries(run)
+        self.assertEqual(Booking.objects.count(), 23)
+
+
+class BookingBulkDeleteTestCase(ConstantQueriesMixin, APITestCase):
+    def setUp(self):
+        self.package = Package.objects.create(
+            category='a', name='package',
+            price=0.0, rating='medium', tour_length=1
+        )
+        self.user = User.objects.create(
+            username='user', email='user@localhost')
+        self.auth_user = auth_header(create_access_token(self.user))
+
+    def make_bookings(self, count, email_address):
+        bookings = []
+        for i in range(count):
+            booking = Booking(
+                package=self.package,
+                start=timezone.now().date(),
+                name='Booking {}'.format(i),
+                email_address=email_address
+            )
+            booking.save()
+            bookings.append(booking)
+        return bookings
+
+    def test_bulk_delete_archives_in_constant_queries(self):
+        def prepare(count):
+            return [booking.pk for booking in
+                    self.make_bookings(count, self.user.email)]
+
+        def run(ids):
+            response = self.client.post(
+                '/api/v1/bookings/bulk_delete/', {'ids': ids},
+                format='json', **self.auth_user)
+            self.assertEqual(response.status_code, 200)
+            response_data: Any = response.data  # type: ignore
+            self.assertEqual(response_data['deleted'], sorted(ids))
+
+        self.assertConstantQueries(run, prepare)
+        self.assertEqual(Booking.objects.count(), 0)
+        self.assertEqual(DeletedData.objects.count(), 23)
+
+    def test_bulk_delete_is_all_or_nothing(self):
+        own = self.make_bookings(2, self.user.email)
+        other = self.make_bookings(1, 'other@localhost')
+        ids = [booking.pk for booking in own + other]
+
+        response = self.client.post(
+            '/api/v1/bookings/bulk_delete/', {'ids': ids},
+            format='json', **self.auth_user)
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.post(
+            '/api/v1/bookings/bulk_delete/', {'ids': ids[:2] + [0]},
+            format='json', **self.auth_user)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Booking.objects.count(), 3)
+        self.assertEqual(DeletedData.objects.count(), 0)
+
+
+class GroupObjectPermissionQueryTestCase(APITestCase):
+    def setUp(self):
+        from guardian.shortcuts import assign_perm
+
+        self.user = User.objects.create(username='agent')
+        self.packages = [
+            Package.objects.create(
+                category='a', name='package {}'.format(i),
+                price=0.0, rating='medium', tour_length=1)
+            for i in range(3)
+        ]
+        for i in range(4):
+            group = Group.objects.create(name='team {}'.format(i))
+            self.user.groups.add(group)
+        assign_perm('api.delete_package', group, self.packages[1])
+        ContentType.objects.get_for_model(Package)
+
+    def test_single_query_across_groups(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(user_has_group_perm(
+                self.user, 'api.delete_package', self.packages[1]))
+        with self.assertNumQueries(1):
+            self.assertFalse(user_has_group_perm(
+                self.user, 'api.delete_package', self.packages[0]))
+
+    def test_batch_check_is_memoized(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                objects_with_group_perm(
+                    self.user, 'api.delete_package', self.packages),
+                {self.packages[1].id}
+            )
+        with self.assertNumQueries(0):
+            self.assertTrue(user_has_group_perm(
+                self.user, 'api.delete_package', self.packages[1]))
+
+    def test_memo_cleared_by_reverse_membership_change(self):
+        self.assertFalse(user_has_group_perm(
+            self.user, 'api.change_package', self.packages[0]))
+        Group.objects.get(name='account_manager').user_set.add(self.user)
+        self.assertTrue(user_has_group_perm(
+            self.user, 'api.change_package', self.packages[0]))
+
+    def test_memo_cleared_by_group_permission_change(self):
+        from django.contrib.auth.models import Permission
+
+        self.assertFalse(user_has_group_perm(
+            self.user, 'api.view_package', self.packages[0]))
+        Group.objects.get(name='team 0').permissions.add(
+            Permission.objects.get(
+                content_type__app_label='api', codename='view_package'))
+        self.assertTrue(user_has_group_perm(
+            self.user, 'api.view_package', self.packages[0]))
+
+    def test_global_group_permission_grants_every_object(self):
+        self.user.groups.add(Group.objects.get(name='account_manager'))
+        self.assertEqual(
+            objects_with_group_perm(
+                self.user, 'api.change_package', self.packages),
+            {package.id for package in self.packages}
+        )
+
+
 class DeleteAndRestoreBooking(APITestCase):
     def setUp(self):
         self.package = Package.objects.create(
@@ -197,29 +779,531 @@ class DeleteAndRestoreBooking(APITestCase):
         self.assertEqual(Booking.objects.count(), 1)
         self.assertEqual(DeletedData.objects.count(), 0)
 
+    def make_bookings(self, count):
+        bookings = []
+        for i in range(count):
+            booking = Booking(
+                package=self.package,
+                start=timezone.now().date(),
+                name='Adventure {}'.format(i),
+                email_address=self.user.email
+            )
+            booking.save()
+            bookings.append(booking)
+        return bookings
+
+    def test_archive_uses_model_label(self):
+        booking = self.make_bookings(1)[0]
+        booking_id = booking.id
+        booking.delete()
+
+        entry = DeletedData.objects.get()
+        self.assertEqual(entry.model_type, 'api.booking')
+        self.assertEqual(entry.model_id, booking_id)
+        self.assertIn('Adventure 0', entry.data)
+
+    def test_restore_many_in_one_transaction(self):
+        bookings = self.make_bookings(3)
+        ids = [booking.id for booking in bookings]
+        for booking in bookings:
+            booking.delete()
+
+        with self.assertRaises(ValueError):
+            restore_bookings(ids + [0])
+        self.assertEqual(Booking.objects.count(), 0)
+
+        # savepoint, select, insert, delete, users, logs, release
+        with self.assertNumQueries(7):
+            restore_bookings(ids)
+        self.assertEqual(
+            sorted(Booking.objects.values_list('id', flat=True)), ids)
+        self.assertEqual(DeletedData.objects.count(), 0)
+        self.assertEqual(
+            list(ActivityLog.objects.filter(
+                action__contains='restored').order_by('id').values_list(
+                    'user', 'action')),
+            [(self.user.id, 'User #{} "user@localhost" restored booking #{}'
+              .format(self.user.id, pk)) for pk in ids])
+
+    def test_purge_old_entries(self):
+        bookings = self.make_bookings(3)
+        ids = [booking.id for booking in bookings]
+        for booking in bookings:
+            booking.delete()
+        DeletedData.objects.filter(model_id__in=ids[:2]).update(
+            archived_at=timezone.now() - timedelta(days=100))
+
+        self.assertEqual(
+            purge_deleted_data(timedelta(days=90), batch_size=1), 2)
+        self.assertEqual(
+            list(DeletedData.objects.values_list('model_id', flat=True)),
+            ids[2:])
+
 
 class PackageCreateViewTestCase(APITestCase):
+    data = {
+        'category': 'Example Category',
+        'name': 'Example',
+        'promo': 'Cool!',
+        'price': 1.23,
+        'rating': 'medium',
+        'tour_length': 5
+    }
+
+    def setUp(self):
+        cache.clear()
+
     def test_create_is_throttled(self):
-        data = {
-            'category': 'Example Category',
-            'name': 'Example',
-            'promo': 'Cool!',
-            'price': 1.23,
-            'rating': 'medium',
-            'tour_length': 5
-        }
         expected_num_objs = Package.objects.count() + 1
-        self.assertFalse(cache.has_key('package_created'))
 
-        response = self.client.post('/api/v1/create_package', data=data)
-        self.assertTrue(cache.has_key('package_created'))
+        response = self.client.post('/api/v1/create_package', data=self.data)
         self.assertEqual(response.status_code, 201)
         self.assertEqual(Package.objects.count(), expected_num_objs)
 
-        response = self.client.post('/api/v1/create_package', data=data)
-        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/api/v1/create_package', data=self.data)
+        self.assertEqual(response.status_code, 429)
+        self.assertLessEqual(int(response['Retry-After']), 600)
         self.assertEqual(Package.objects.count(), expected_num_objs)
 
+    def test_throttle_is_per_client(self):
+        response = self.client.post('/api/v1/create_package', data=self.data)
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(
+            '/api/v1/create_package', data=self.data,
+            REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.create(username='user')
+        response = self.client.post(
+            '/api/v1/create_package', data=self.data,
+            **auth_header(create_access_token(user)))
+        self.assertEqual(response.status_code, 201)
+
+    def test_fake_bearer_tokens_share_the_ip_limit(self):
+        statuses = [
+            self.client.post(
+                '/api/v1/create_package', data=self.data,
+                HTTP_AUTHORIZATION='Bearer fake{}'.format(i)).status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [201, 429, 429])
+
+
+class AtomicDatabaseCacheTestCase(TestCase):
+    def setUp(self):
+        from django.core.management import call_command
+
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'demo.cache.AtomicDatabaseCache',
+                'LOCATION': 'test_cache_entries'}}):
+            call_command('createcachetable', verbosity=0)
+        self.cache = AtomicDatabaseCache('test_cache_entries', {})
+
+    def expires(self, key):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT expires FROM test_cache_entries WHERE cache_key = %s',
+                [self.cache.make_key(key)])
+            return cursor.fetchone()[0]
+
+    def test_incr_keeps_the_expiry(self):
+        self.cache.add('counter', 0, timeout=None)
+        expires = self.expires('counter')
+        self.assertEqual(self.cache.incr('counter'), 1)
+        self.assertEqual(self.cache.decr('counter', 3), -2)
+        self.assertEqual(self.expires('counter'), expires)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_add_claims_only_expired_entries(self):
+        self.cache.set('lock', 'old', timeout=-1)
+        self.assertTrue(self.cache.add('lock', 'first', timeout=60))
+        self.assertFalse(self.cache.add('lock', 'second', timeout=60))
+        self.assertEqual(self.cache.get('lock'), 'first')
+
+    def test_writes_do_not_count_or_cull(self):
+        self.cache._max_entries = 1
+        with CaptureQueriesContext(connection) as queries:
+            for key in ('a', 'b', 'c'):
+                self.cache.set(key, key)
+            self.cache.set('a', 'again')
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']),
+                         {'a': 'again', 'b': 'b', 'c': 'c'})
+
+    def test_touch_and_purge_expired(self):
+        self.cache.set('live', 1, timeout=60)
+        self.cache.set('expired', 1, timeout=-1)
+        self.assertTrue(self.cache.touch('live', timeout=None))
+        self.assertFalse(self.cache.touch('expired', timeout=None))
+        self.assertFalse(self.cache.touch('missing'))
+
+        self.assertEqual(self.cache.purge_expired(batch_size=1), 1)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT cache_key FROM test_cache_entries')
+            self.assertEqual(
+                cursor.fetchall(), [(self.cache.make_key('live'),)])
+
+
+class TwoTierCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def make_cache(self, **options):
+        options = dict({'L2': 'shared', 'L1_SYNC_INTERVAL': 0}, **options)
+        return TwoTierCache(None, {'OPTIONS': options})
+
+    def test_hits_are_counted_per_tier(self):
+        first, second = self.make_cache(), self.make_cache()
+        first.set('key', 'value')
+        self.assertEqual(first.get('key'), 'value')
+        self.assertEqual(second.get('key'), 'value')
+        self.assertEqual(second.get('key'), 'value')
+        self.assertIsNone(second.get('missing'))
+
+        self.assertEqual(first.stats()['l1'], {
+            'hits': 1, 'misses': 0, 'hit_ratio': 1.0})
+        self.assertEqual(second.stats(), {
+            'l1': {'hits': 1, 'misses': 2, 'hit_ratio': 1 / 3},
+            'l2': {'hits': 1, 'misses': 1, 'hit_ratio': 0.5},
+        })
+
+    def test_writes_invalidate_other_processes(self):
+        first, second = self.make_cache(), self.make_cache()
+        first.set('key', 1)
+        self.assertEqual(second.get('key'), 1)
+        first.set('key', 2)
+        self.assertEqual(second.get('key'), 2)
+        first.delete('key')
+        self.assertIsNone(second.get('key'))
+
+    def test_immutable_keys_are_not_published(self):
+        first = self.make_cache(L1_IMMUTABLE=True)
+        second = self.make_cache(L1_IMMUTABLE=True)
+        with CaptureQueriesContext(connection) as queries:
+            first.set('key', 1)
+            self.assertEqual(first.get('key'), 1)
+            self.assertEqual(second.get('key'), 1)
+            self.assertEqual(second.get('key'), 1)
+        self.assertFalse(any(
+            'two_tier/' in query['sql'] for query in queries.captured_queries))
+        self.assertIsNone(cache.get(INVALIDATION_SEQ_KEY))
+
+    def test_l1_is_bounded_and_filtered_by_prefix(self):
+        l1 = self.make_cache(L1_MAX_ENTRIES=2, L1_KEY_PREFIXES=['l1/'])
+        for key in ('l1/a', 'l1/b', 'l1/c', 'other'):
+            l1.set(key, key)
+        # 'l1/a' was evicted by 'l1/c'
+        for key in ('l1/c', 'l1/b', 'l1/a', 'other'):
+            self.assertEqual(l1.get(key), key)
+        self.assertEqual(l1.stats()['l1']['misses'], 1)
+        self.assertEqual(l1.stats()['l2']['hits'], 2)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class ReadReplicaRouterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        mark_replica_synced('replica_1', time.time())
+        self.router = ReadReplicaRouter()
+        self.middleware = ReplicaStickinessMiddleware(self.view)
+        self.routes = []
+
+    def view(self, request):
+        with replica_reads():
+            self.routes.append(self.router.db_for_read(Package))
+            if request.method == 'POST':
+                self.router.db_for_write(Package)
+                self.routes.append(self.router.db_for_read(Package))
+        return HttpResponse()
+
+    def test_reads_go_to_replica_until_a_write(self):
+        self.middleware(RequestFactory().get('/'))
+        self.middleware(RequestFactory().post('/'))
+        self.assertEqual(self.routes, ['replica_1', 'replica_1', 'default'])
+        self.assertIsNone(self.router.db_for_read(Package))
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        self.middleware(RequestFactory().post('/'))
+        self.middleware(RequestFactory().get('/'))
+        self.middleware(RequestFactory().get('/', REMOTE_ADDR='10.0.0.2'))
+        self.assertEqual(
+            self.routes, ['replica_1', 'default', 'default', 'replica_1'])
+
+        # Until a replica is synced after the write
+        mark_replica_synced('replica_1', time.time() + 1)
+        self.middleware(RequestFactory().get('/'))
+        self.assertEqual(self.routes[-1], 'replica_1')
+
+    @override_settings(REPLICA_MAX_LAG=60)
+    def test_lagging_replicas_are_not_read(self):
+        mark_replica_synced('replica_1', time.time() - 61)
+        self.middleware(RequestFactory().get('/'))
+        self.assertEqual(self.routes, ['default'])
+
+    def test_database_cache_stays_on_primary(self):
+        cache_entry = AtomicDatabaseCache('cache_entries', {}).cache_model_class
+
+        def view(request):
+            del request
+            with replica_reads():
+                self.routes.append(self.router.db_for_write(cache_entry))
+                self.routes.append(self.router.db_for_read(cache_entry))
+                self.routes.append(self.router.db_for_read(Package))
+            return HttpResponse()
+
+        ReplicaStickinessMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(self.routes, ['default', 'default', 'replica_1'])
+
+    def test_migrations_only_run_on_primary(self):
+        self.assertTrue(self.router.allow_migrate('default', 'api'))
+        self.assertFalse(self.router.allow_migrate('replica_1', 'api'))
+
+
+class CachedAccessTokenTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user')
+        self.token = create_access_token(self.user)
+        self.auth_user = auth_header(self.token)
+
+    def token_queries(self, url='/api/v1/packages/'):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **self.auth_user)
+        return response.status_code, len([
+            query for query in queries.captured_queries
+            if 'oauth2_provider_accesstoken' in query['sql']])
+
+    def test_one_lookup_per_request_then_none(self):
+        self.assertEqual(self.token_queries(), (200, 1))
+        self.assertEqual(self.token_queries(), (200, 0))
+
+    def test_scope_change_and_revocation_apply_at_once(self):
+        self.assertEqual(self.token_queries(), (200, 1))
+
+        self.token.scope = 'read write'
+        self.token.save()
+        self.assertEqual(self.token_queries(), (403, 1))
+
+        self.token.revoke()
+        self.assertEqual(self.token_queries(), (401, 1))
+
+    def test_only_token_fields_are_cached(self):
+        from api.oauth2 import access_token_cache_key
+
+        self.assertEqual(self.token_queries(), (200, 1))
+        self.assertEqual(cache.get(access_token_cache_key(self.token.token)), {
+            'id': self.token.id,
+            'user_id': self.user.id,
+            'application_id': self.token.application_id,
+            'scope': self.token.scope,
+            'expires': self.token.expires,
+        })
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=['last_login'])
+
+    def test_user_deletion_revokes_the_token(self):
+        self.assertEqual(self.token_queries(), (200, 1))
+        self.user.delete()
+        self.assertEqual(self.token_queries(), (401, 1))
+
+
+class FastListTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='user', email='user@localhost')
+        self.auth_user = auth_header(create_access_token(self.user))
+        for i in range(12):
+            package = Package.objects.create(
+                category='a', name='package {}'.format(i), promo='promo',
+                price=i * 1.5, rating='medium', tour_length=i)
+            PackagePermission.set_can_write(self.user, package)
+            Booking.objects.create(
+                package=package, start=timezone.now().date(),
+                name='booking {}'.format(i), email_address='x@localhost')
+
+    def assert_same_content(self, viewset, url, params, **headers):
+        responses = []
+        for fast_list in (False, True):
+            cache.clear()
+            with patch.object(viewset, 'fast_list', fast_list):
+                response = self.client.get(url, params, **headers)
+            self.assertEqual(response.status_code, 200)
+            responses.append(response.content)
+        self.assertEqual(responses[0], responses[1])
+
+    def test_output_is_identical(self):
+        for params in ({}, {'page': 2}, {'pagination': 'cursor'},
+                       {'search': 'package', 'price_min': 3}):
+            self.assert_same_content(
+                PublicPackageViewSet, '/api/v1/public/packages/', params)
+            self.assert_same_content(
+                PackageViewSet, '/api/v1/packages/', params, **self.auth_user)
+        self.assert_same_content(BookingViewSet, '/api/v1/bookings/', {})
+
+    def test_list_builds_no_model_instances(self):
+        with patch.object(Package, '__init__') as init:
+            response = self.client.get('/api/v1/public/packages/')
+        self.assertEqual(response.status_code, 200)
+        init.assert_not_called()
+
+
+class PackageExportTestCase(APITestCase):
+    def setUp(self):
+        self.packages = [
+            Package.objects.create(
+                category='a' if i % 2 else 'b', name='package {}'.format(i),
+                price=i, rating='medium', tour_length=1)
+            for i in range(5)
+        ]
+
+    def export(self, **params):
+        with patch.object(PublicPackageViewSet, 'export_chunk_size', 2):
+            response = self.client.get(
+                '/api/v1/public/packages/export/', params)
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content)
+        if params.get('compression') == 'gzip':
+            self.assertEqual(response['Content-Type'], 'application/gzip')
+            body = gzip.decompress(body)
+        return [json.loads(line) for line in body.decode().splitlines()]
+
+    def test_export_ndjson_in_id_order(self):
+        rows = self.export()
+        self.assertEqual([row['id'] for row in rows],
+                         [package.id for package in self.packages])
+        self.assertEqual(rows[0]['name'], 'package 0')
+        self.assertEqual(self.export(compression='gzip'), rows)
+
+    def test_export_resumes_after_id_with_filters(self):
+        rows = self.export(after=self.packages[1].id, category='a')
+        self.assertEqual([row['id'] for row in rows], [self.packages[3].id])
+
+        response = self.client.get(
+            '/api/v1/public/packages/export/', {'after': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class PackageBulkCreateViewTestCase(ConstantQueriesMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user')
+        self.auth_user = auth_header(create_access_token(self.user))
+
+    def rows(self, count):
+        return [
+            {
+                'category': 'a', 'name': 'Package {}'.format(i),
+                'promo': 'promo', 'price': i, 'rating': 'medium',
+                'tour_length': 5,
+            }
+            for i in range(count)
+        ]
+
+    def test_json_array_in_batches_with_owner(self):
+        rows = self.rows(5)
+        rows[3] = {'name': 'No price'}
+        with patch.object(PackageBulkCreateView, 'batch_size', 2):
+            response = self.client.post(
+                '/api/v1/create_package/bulk', json.dumps(rows),
+                content_type='application/json', **self.auth_user)
+        self.assertEqual(response.status_code, 201)
+        response_data: Any = response.data  # type: ignore
+        self.assertEqual(response_data['created'], 4)
+        self.assertEqual(response_data['error_count'], 1)
+        self.assertEqual(response_data['errors'][0]['row'], 3)
+
+        packages = Package.objects.all()
+        self.assertEqual(len(packages), 4)
+        self.assertEqual(
+            PackagePermission.can_write_many(self.user, packages),
+            {package.id for package in packages})
+        response = self.client.get(
+            '/api/v1/public/packages/', {'search': 'package'})
+        response_data = response.data  # type: ignore
+        self.assertEqual(response_data['count'], 4)
+
+    def test_ndjson_in_constant_queries(self):
+        def run(count):
+            body = '\n'.join(json.dumps(row) for row in self.rows(count))
+            response = self.client.post(
+                '/api/v1/create_package/bulk', body,
+                content_type='application/x-ndjson', **self.auth_user)
+            self.assertEqual(response.status_code, 201)
+
+        self.assertConstantQueries(run)
+        self.assertEqual(Package.objects.count(), 23)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_body_is_not_read_to_authenticate(self):
+        body = '\n'.join(json.dumps(row) for row in self.rows(50))
+        self.assertGreater(len(body), 1024)
+        response = self.client.post(
+            '/api/v1/create_package/bulk', body,
+            content_type='application/x-ndjson', **self.auth_user)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Package.objects.count(), 50)
+
+        # Form bodies are still read, as they may carry the token
+        from api.oauth2 import ResourceOAuthLibCore
+        token = self.auth_user['HTTP_AUTHORIZATION'].split()[1]
+        request = RequestFactory().post('/', {'access_token': token})
+        valid, _ = ResourceOAuthLibCore().verify_request(request, scopes=[])
+        self.assertTrue(valid)
+
+
+    def test_content_type_parameters(self):
+        rows = self.rows(2)
+        rows[1]['name'] = 'Caf\u00e9'
+        response = self.client.post(
+            '/api/v1/create_package/bulk',
+            json.dumps(rows, ensure_ascii=False).encode('latin-1'),
+            content_type='application/json; charset=latin-1',
+            **self.auth_user)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Package.objects.filter(name='Caf\u00e9').exists())
+
+        response = self.client.post(
+            '/api/v1/create_package/bulk', '[]',
+            content_type='application/json; charset=unknown',
+            **self.auth_user)
+        self.assertEqual(response.status_code, 415)
+
+    def test_malformed_body_creates_nothing(self):
+        body = json.dumps(self.rows(3))[:-10]
+        with patch.object(PackageBulkCreateView, 'batch_size', 1):
+            response = self.client.post(
+                '/api/v1/create_package/bulk', body,
+                content_type='application/json', **self.auth_user)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Package.objects.count(), 0)
+
+
+class SlidingWindowTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def hits(self, window, at, count):
+        # Only the throttle's clock, the cache expires entries by the real one
+        with patch('demo.throttling.time') as clock:
+            clock.time.return_value = at
+            return [window.hit() for _ in range(count)]
+
+    def test_previous_window_is_weighted(self):
+        window = SlidingWindow('test', limit=4, period=60)
+        self.assertEqual(self.hits(window, 0, 5), [(True, 0)] * 4 + [(False, 75)])
+        # Half of the previous window still counts: 4 * 0.5 + 2 <= 4
+        self.assertEqual(
+            self.hits(window, 90, 3), [(True, 0)] * 2 + [(False, 15)])
+        self.assertEqual(self.hits(window, 105, 1), [(True, 0)])
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('10/min'), (10, 60))
+        self.assertEqual(parse_rate('1/5min'), (1, 300))
+        with self.assertRaises(ValueError):
+            parse_rate('10/fortnight')
+
 
 class UserDataDownloadViewTestCase(APITestCase):
     def setUp(self):
@@ -244,7 +1328,8 @@ class UserDataDownloadViewTestCase(APITestCase):
             **self.auth_user
         )
         self.assertEqual(response.status_code, 200)
-        content = str(response.content, encoding='utf8')
+        self.assertTrue(response.streaming)
+        content = str(b''.join(response.streaming_content), encoding='utf8')
         self.assertEqual(content, """"Data for user@localhost"
 "Comments"
 "Bookings"
@@ -256,3 +1341,122 @@ class UserDataDownloadViewTestCase(APITestCase):
             self.now.year, self.now.month, self.now.day,
             self.user.id, self.booking.id
         ))
+
+    def test_download_joins_package_data(self):
+        for i in range(5):
+            Booking.objects.create(
+                package=self.package,
+                start=self.now,
+                name='Adventure {}'.format(i),
+                email_address=self.user.email
+            )
+        response = self.client.get('/api/v1/download', **self.auth_user)
+        with self.assertNumQueries(3):
+            content = b''.join(response.streaming_content)
+        self.assertEqual(content.count(b'"package","0.0"'), 6)
+
+
+class UserDataExportJobTestCase(APITestCase):
+    def setUp(self):
+        self.export_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_root)
+        self.user = User.objects.create(
+            username='user', email='user@localhost')
+        self.auth_user = auth_header(create_access_token(self.user))
+
+    @patch('api.views.export_user_data.delay')
+    def test_repeated_requests_reuse_running_job(self, delay):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.client.post('/api/v1/exports', **self.auth_user)
+            second = self.client.post('/api/v1/exports', **self.auth_user)
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.status_code, 202)
+        self.assertEqual(first.data['id'], second.data['id'])  # type: ignore
+        self.assertEqual(DataExportJob.objects.count(), 1)
+        delay.assert_called_once_with(first.data['id'])  # type: ignore
+
+    def test_download_finished_export(self):
+        job, _ = DataExportJob.get_or_start(self.user)
+        url = '/api/v1/exports/{}/file'.format(job.id)
+        response = self.client.get(url, **self.auth_user)
+        self.assertEqual(response.status_code, 409)
+
+        with override_settings(USER_DATA_EXPORT_ROOT=self.export_root):
+            export_user_data.run(job.id)
+        response = self.client.get(
+            '/api/v1/exports/{}'.format(job.id), **self.auth_user)
+        self.assertEqual(response.data['status'], 'done')  # type: ignore
+
+        response = self.client.get(url, **self.auth_user)
+        self.assertEqual(response.status_code, 200)
+        content = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(content, b'"Data for user@localhost"\n'
+                                  b'"Comments"\n'
+                                  b'"Bookings"\n'
+                                  b'"package_name","package_price","start","name"\n'
+                                  b'"Activity Log"\n')
+
+
+    def test_missing_and_expired_exports(self):
+        jobs = []
+        for _ in range(2):
+            job, _ = DataExportJob.get_or_start(self.user)
+            with override_settings(USER_DATA_EXPORT_ROOT=self.export_root):
+                export_user_data.run(job.id)
+            jobs.append(DataExportJob.objects.get(id=job.id))
+        old, recent = jobs
+        DataExportJob.objects.filter(id=old.id).update(
+            finished_at=timezone.now() - timedelta(days=8))
+
+        self.assertEqual(DataExportJob.purge(timedelta(days=7)), 1)
+        self.assertFalse(DataExportJob.objects.filter(id=old.id).exists())
+        self.assertFalse(os.path.exists(old.file_path))
+        self.assertTrue(os.path.exists(recent.file_path))
+        response = self.client.get(
+            '/api/v1/exports/{}/file'.format(old.id), **self.auth_user)
+        self.assertEqual(response.status_code, 404)
+
+        os.remove(recent.file_path)
+        response = self.client.get(
+            '/api/v1/exports/{}/file'.format(recent.id), **self.auth_user)
+        self.assertEqual(response.status_code, 410)
+
+
+class ActivityLogBufferTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            username='user', email='user@localhost')
+
+    def test_entries_are_written_in_order_when_buffer_closes(self):
+        with buffered_activity_log():
+            ActivityLog.record(user=self.user, action='first')
+            ActivityLog.record(user=None, action='second')
+            self.assertEqual(ActivityLog.objects.count(), 0)
+        self.assertEqual(
+            list(ActivityLog.objects.order_by('id').values_list(
+                'action', flat=True)),
+            ['first', 'second']
+        )
+
+    def test_entries_are_flushed_on_commit(self):
+        with buffered_activity_log():
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    ActivityLog.record(user=self.user, action='committed')
+                    self.assertEqual(ActivityLog.objects.count(), 0)
+            self.assertEqual(ActivityLog.objects.count(), 1)
+
+    def test_entries_survive_rollback(self):
+        with buffered_activity_log():
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    ActivityLog.record(user=self.user, action='rolled back')
+                    raise ValueError()
+        self.assertEqual(ActivityLog.objects.get().action, 'rolled back')
+
+    @patch('api.tasks.write_activity_logs.delay')
+    def test_async_flush(self, delay):
+        with buffered_activity_log(async_flush=True):
+            ActivityLog.record(user=self.user, action='queued')
+        delay.assert_called_once_with([(self.user.id, 'queued')])
+        self.assertEqual(ActivityLog.objects.count(), 0)
@@ -1,7 +1,74 @@
+import threading
+import time
+from contextlib import contextmanager
 from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.utils import timezone
 
 
+def model_version_key(model):
+    return '{}/version'.format(model._meta.label_lower)
+
+
+def model_version(model):
+    """
+    Returns a number that changes on every save or delete of an instance
+    of `model` (see `bump_model_version`).
+    """
+    key = model_version_key(model)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so a lost counter never reuses old values.
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_model_version(model):
+    """
+    Changes the version of `model` once the current transaction commits,
+    so that a reader cannot cache data that is not committed yet under the
+    new version. A transaction bumps each version once, however many rows
+    it writes.
+    """
+    key = model_version_key(model)
+
+    def bump():
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1000), timeout=None)
+
+    on_commit_once(key, bump)
+
+
+_pending_commit_hooks = threading.local()
+
+
+def on_commit_once(key, func):
+    """
+    Like `transaction.on_commit`, but `func` runs only once per `key`
+    when the transaction commits, however many times it was scheduled.
+
+    Every call registers a hook, so the function still runs if the
+    savepoint of an earlier call is rolled back; the first hook to run
+    does the work and the others find nothing pending.
+    """
+    pending = getattr(_pending_commit_hooks, 'keys', None)
+    if pending is None:
+        pending = _pending_commit_hooks.keys = set()
+    pending.add(key)
+
+    def run():
+        if key in pending:
+            pending.discard(key)
+            func()
+
+    transaction.on_commit(run)
+
+
 def create_access_token(user):
     import oauth2_provider.models
     application_model = oauth2_provider.models.get_application_model()
@@ -24,6 +91,25 @@ def auth_header(token):
     return {'HTTP_AUTHORIZATION': 'Bearer {}'.format(token)}
 
 
+@contextmanager
+def capture_model_queries():
+    """
+    Captures the SQL of the queries made in the block, leaving out those
+    of the shared database cache, so tests can count the model queries.
+    """
+    from django.test.utils import CaptureQueriesContext
+    table = settings.CACHES['shared'].get('LOCATION')
+    queries = []
+    with CaptureQueriesContext(connection) as context:
+        yield queries
+    queries.extend(
+        query['sql'] for query in context.captured_queries
+        if table not in query['sql']
+        # The cache's add and set run in savepoints
+        and 'SAVEPOINT' not in query['sql']
+    )
+
+
 def assign_perms(group_permissions):
     """
     Assigns permissions to a set of groups.
@@ -59,12 +145,112 @@ def group_has_perm(group, perm, obj):
     ).filter(id=obj.id).exists()
 
 
+_group_perm_generation = 0
+
+
+def _group_perm_memo(user):
+    """
+    Per-user memo of group permission checks. It lives on the user
+    instance, like Django's own permission caches, so it lasts for one
+    request. It is dropped when `clear_group_perm_memos` is called.
+    """
+    memo = getattr(user, '_group_perm_cache', None)
+    if memo is None or memo[0] != _group_perm_generation:
+        memo = user._group_perm_cache = (_group_perm_generation, {})
+    return memo[1]
+
+
+def clear_group_perm_memos():
+    """
+    Invalidates the group permission memo of every user instance in this
+    process, for changes to group memberships or group permissions.
+    """
+    global _group_perm_generation
+    _group_perm_generation += 1
+
+
+def objects_with_group_perm(user, perm, objects):
+    """
+    Returns the primary keys of the given model instances that `user`
+    can reach with permission `perm` through any of their groups, either
+    as a global group permission or as an object permission.
+
+    All the objects must be of the same model. Runs at most one query.
+    """
+    from django.contrib.auth.models import Group
+    from django.contrib.contenttypes.models import ContentType
+    from django.db.models import CharField, Value
+    from guardian.utils import get_group_obj_perms_model
+
+    objects = list(objects)
+    if not objects:
+        return set()
+    memo = _group_perm_memo(user)
+    label = objects[0]._meta.label
+    pending = [obj.pk for obj in objects if (perm, label, obj.pk) not in memo]
+
+    if pending:
+        content_type = ContentType.objects.get_for_model(objects[0])
+        codename = perm.split('.')[-1]
+        global_perms = Group.permissions.through.objects.filter(
+            group__user=user,
+            permission__content_type=content_type,
+            permission__codename=codename,
+        ).annotate(
+            object_pk=Value('*', output_field=CharField())
+        ).values_list('object_pk', flat=True)
+        object_perms = get_group_obj_perms_model().objects.filter(
+            group__user=user,
+            permission__content_type=content_type,
+            permission__codename=codename,
+            content_type=content_type,
+            object_pk__in=[str(pk) for pk in pending],
+        ).values_list('object_pk', flat=True)
+        # A '*' row means a global group permission, which grants every
+        # object.
+        granted = set(global_perms.union(object_perms))
+        for pk in pending:
+            memo[(perm, label, pk)] = '*' in granted or str(pk) in granted
+
+    return {obj.pk for obj in objects if memo[(perm, label, obj.pk)]}
+
+
 def user_has_group_perm(user, perm, obj):
     """
     Returns true if one of the groups that the `user is part of has the
     given permission `perm` for the given model instance `obj`.
     """
-    for g in user.groups.all():
-        if group_has_perm(g, perm, obj):
-            return True
-    return False
+    return obj.pk in objects_with_group_perm(user, perm, [obj])
+
+
+def user_data_rows(user, chunk_size=2000):
+    """
+    Yields the CSV rows of the data export for `user`, one section at a
+    time. Each section is read in chunks of `chunk_size` rows so memory
+    use does not depend on how much data the user has.
+    """
+    from api.models import Booking, ActivityLog
+    from ugc.models import Comment
+
+    yield ['Data for {}'.format(user.email)]
+    yield ['Comments']
+    comments = Comment.objects.filter(
+        created_by=user
+    ).order_by('id').values_list('text', flat=True)
+    for text in comments.iterator(chunk_size=chunk_size):
+        yield text
+
+    yield ['Bookings']
+    yield ['package_name', 'package_price', 'start', 'name']
+    bookings = Booking.objects.filter(
+        email_address=user.email
+    ).order_by('id').values_list(
+        'package__name', 'package__price', 'start', 'name'
+    )
+    yield from bookings.iterator(chunk_size=chunk_size)
+
+    yield ['Activity Log']
+    logs = ActivityLog.objects.filter(
+        user=user
+    ).order_by('id').values_list('action')
+    yield from logs.iterator(chunk_size=chunk_size)
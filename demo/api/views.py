@@ -1,21 +1,50 @@
+import codecs
 import csv
+import hashlib
+import io
+import json
+import operator
+import shutil
+import tempfile
+import zlib
+from functools import reduce
+from itertools import islice
 
+from django.conf import settings
 from django.core.cache import cache
-from django.http.response import HttpResponse
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max, Q
+from django.http.response import FileResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date, parse_header_parameters, parse_http_date
 
 from rest_framework.generics import CreateAPIView, RetrieveAPIView
-from rest_framework import viewsets
+from rest_framework.views import APIView
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ParseError, UnsupportedMediaType
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from rest_framework.filters import BaseFilterBackend
 from rest_framework.permissions import BasePermission, DjangoModelPermissions
 
+from django_filters.rest_framework import DjangoFilterBackend
 from oauth2_provider.views.mixins import ProtectedResourceMixin
 from oauth2_provider.contrib.rest_framework import TokenHasReadWriteScope, TokenHasScope
 
-from api.models import Package, PackagePermission, Booking, ActivityLog
-from api.serializers import PackageSerializer, BookingSerializer
-from ugc.models import Comment
+from demo.db import replica_reads
+from demo.throttling import SlidingWindowRateThrottle
+
+from api.filters import PackageFilter, package_facets
+from api.models import Package, PackagePermission, Booking, DataExportJob, bulk_create_bookings, bulk_create_packages, delete_bookings
+from api.parsers import NDJSONParser, iter_json_array, iter_ndjson
+from api.search import search_packages
+from api.serializers import compile_values_serializer, PackageSerializer, PackageWriteAccessSerializer, BookingSerializer, BookingIdsSerializer, DataExportJobSerializer, validate_rows
+from api.tasks import export_user_data
+from api.utils import model_version, user_data_rows
 
 
 class BookingObjectPermission(BasePermission):
@@ -40,21 +69,217 @@ class PackageCreateView(CreateAPIView):
     queryset = Package.objects.all()
     serializer_class = PackageSerializer
     permission_classes = [BasePermission]
+    throttle_classes = [SlidingWindowRateThrottle]
+    throttle_scope = 'create_package'
 
-    def post(self, *args, **kwargs):
-        if cache.has_key('package_created'):
-            return Response(status=200)
-        response = super().post(*args, **kwargs)
-        if response.status_code == 201:
-            cache.set('package_created', True, timeout=300)
-        return response
+
+class PackageBulkCreateView(APIView):
+    """
+    Creates packages owned by the user from a JSON array or an NDJSON
+    body. The body is first spooled to a temporary file and checked to be
+    well-formed, so a malformed body saves nothing and no transaction is
+    held open while the upload is received. Rows are then read, validated
+    and saved `batch_size` at a time, one transaction per batch, so memory
+    use does not grow with the upload. Invalid rows are reported by their
+    index in the upload, up to `max_reported_errors`.
+    """
+    batch_size = 500
+    max_reported_errors = 100
+    throttle_classes = [SlidingWindowRateThrottle]
+    throttle_scope = 'create_package_bulk'
+    row_readers = {
+        NDJSONParser.media_type: iter_ndjson,
+        'application/json': iter_json_array,
+    }
+
+    def post(self, request, *args, **kwargs):
+        del args, kwargs
+        media_type, params = parse_header_parameters(request.content_type)
+        read_rows = self.row_readers.get(media_type)
+        if read_rows is None:
+            raise UnsupportedMediaType(request.content_type)
+        encoding = params.get('charset', settings.DEFAULT_CHARSET)
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            raise UnsupportedMediaType(request.content_type)
+
+        with tempfile.SpooledTemporaryFile(
+                max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE) as body:
+            shutil.copyfileobj(request.stream or io.BytesIO(), body)
+            body.seek(0)
+            for _ in read_rows(body, encoding):
+                pass
+            body.seek(0)
+            return self.create(request.user, read_rows(body, encoding))
+
+    def create(self, owner, rows):
+        created, errors, error_count, offset = 0, [], 0, 0
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            valid_rows, batch_errors = validate_rows(PackageSerializer, batch)
+            created += len(bulk_create_packages(owner, valid_rows))
+            error_count += len(batch_errors)
+            for error in batch_errors:
+                if len(errors) < self.max_reported_errors:
+                    errors.append(dict(error, row=error['row'] + offset))
+            offset += len(batch)
+
+        return Response(
+            {'created': created, 'errors': errors, 'error_count': error_count},
+            status=status.HTTP_201_CREATED if created or not error_count
+            else status.HTTP_400_BAD_REQUEST,
+        )
 
 
 class PackagePagination(PageNumberPagination):
     page_size = 10
 
 
+class PackageCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the view's `cursor_ordering`, which must end
+    with a unique field and have no null values.
+
+    DRF's cursor only holds the first ordering field and skips the rows
+    that tie on it with an OFFSET, capped at `offset_cutoff`. Here the
+    cursor holds the values of every ordering field of the row it points
+    at, and a page is read with a row comparison on all of them, so ties
+    cost nothing. It issues no COUNT query and its cost does not grow
+    with the page depth.
+    """
+    page_size = 10
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse, position = (self.cursor.reverse, self.cursor.position) \
+            if self.cursor else (False, None)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(name[1:] if name.startswith('-') else '-' + name
+                             for name in ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.after_position(
+                    ordering, self.position_values(position)))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None, position
+            self.has_previous = following_position is not None
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.next_position = following_position
+            self.has_previous = position is not None
+            self.previous_position = position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def position_values(self, position):
+        values = json.loads(position)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise ValueError('Invalid cursor position.')
+        return values
+
+    @staticmethod
+    def after_position(ordering, values):
+        """
+        Returns the condition selecting the rows that come after `values`
+        in `ordering`: (a, b) > (x, y) is a > x OR (a = x AND b > y).
+        """
+        conditions, equal = [], {}
+        for name, value in zip(ordering, values):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            conditions.append(
+                Q(**equal, **{'{}__{}'.format(field, lookup): value}))
+            equal[field] = value
+        return reduce(operator.or_, conditions)
+
+    def _get_position_from_instance(self, instance, ordering):
+        return json.dumps([
+            instance[name.lstrip('-')] if isinstance(instance, dict)
+            else getattr(instance, name.lstrip('-'))
+            for name in ordering
+        ], cls=DjangoJSONEncoder)
+
+
+class OptionalCursorPaginationMixin:
+    """
+    Lets clients opt into cursor pagination with `?pagination=cursor`,
+    keeping page-number pagination as the default.
+    """
+    cursor_pagination_class = PackageCursorPagination
+    cursor_ordering = ('id',)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = self.cursor_pagination_class()
+                self._paginator.ordering = self.cursor_ordering
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+
+class FastListMixin:
+    """
+    Builds list responses from `.values()` rows with the field mapping of
+    `compile_values_serializer`, skipping model instances and the
+    per-object serializer machinery. The output is the serializer's.
+    """
+    fast_list = True
+
+    def list(self, request, *args, **kwargs):
+        compiled = self.fast_list and compile_values_serializer(
+            self.get_serializer_class())
+        if not compiled:
+            return super().list(request, *args, **kwargs)
+        names, to_representation = compiled
+
+        queryset = self.filter_queryset(self.get_queryset())
+        # Cursor pagination reads the ordering fields from the rows
+        ordering = [name.lstrip('-') for name in (
+            *queryset.query.order_by, *getattr(self, 'cursor_ordering', ()))
+            if isinstance(name, str)]
+        rows = queryset.values(*dict.fromkeys(names + tuple(ordering)))
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(
+                [to_representation(row) for row in page])
+        return Response([to_representation(row) for row in rows])
+
+
 class CanWritePackageFilterBackend(BaseFilterBackend):
+    # Owned ID sets larger than this are joined instead of inlined as
+    # query parameters.
+    max_inline_ids = 500
+
     def filter_queryset(self, request, queryset, view):
         queryset = self.check_permission(request, queryset, view)
         filters = {}
@@ -68,61 +293,389 @@ class CanWritePackageFilterBackend(BaseFilterBackend):
             return queryset.none()
         if request.user.username == 'admin':
             return queryset
-        package_ids = queryset.values_list('id', flat=True)
-        own_package_ids = PackagePermission.objects.filter(
-            is_owner=True, package__in=package_ids, user=request.user,
-        ).values_list('package__id', flat=True)
+        own_package_ids = PackagePermission.owned_package_ids(request.user)
+        if len(own_package_ids) > self.max_inline_ids:
+            return queryset.filter(
+                packagepermission__user=request.user,
+                packagepermission__is_owner=True,
+            )
         return queryset.filter(id__in=own_package_ids)
 
 
-class PackageViewSet(viewsets.ModelViewSet):
+class PackageSearchFilter(BaseFilterBackend):
+    """
+    Full-text search on the package name and promo with `?search=`,
+    ranked by relevance.
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        del view
+        return search_packages(
+            queryset, request.query_params.get(self.search_param, ''))
+
+
+class ConditionalGetMixin:
+    """
+    Adds an ETag header to list and detail responses, and a Last-Modified
+    header to detail responses, and answers requests whose validators
+    still match with `304 Not Modified`.
+
+    List ETags hash the latest `updated_at` of the filtered rows, read
+    with one MAX() query, and the cached write versions of
+    `conditional_models`, which also change on deletes and permission
+    changes. Lists have no Last-Modified: deletes and permission changes
+    do not advance MAX(updated_at), and a delete can even move it back.
+    A 304 costs no serialization.
+    """
+    conditional_models = ()
+
+    def list(self, request, *args, **kwargs):
+        state = self.filter_queryset(self.get_queryset()).order_by().aggregate(
+            updated_at=Max('updated_at'))
+        state['versions'] = [
+            model_version(model) for model in self.conditional_models]
+        return self.conditional_response(
+            super().list, state, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            last_modified = self.filter_queryset(self.get_queryset()).filter(
+                **{self.lookup_field: lookup}
+            ).values_list('updated_at', flat=True).first()
+        except (TypeError, ValueError, ValidationError):
+            last_modified = None
+        if last_modified is None:
+            return super().retrieve(request, *args, **kwargs)
+        state = {'last_modified': last_modified, 'pk': lookup}
+        return self.conditional_response(
+            super().retrieve, state, request, *args, **kwargs)
+
+    def conditional_response(self, view, state, request, *args, **kwargs):
+        etag = quote_etag(hashlib.sha256(
+            repr(sorted(state.items())).encode()).hexdigest()[:32])
+        last_modified = state.get('last_modified')
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        return conditional_response(
+            request, etag, timestamp, view, *args, **kwargs)
+
+
+def conditional_response(request, etag, timestamp, view, *args, **kwargs):
+    """
+    Returns `304 Not Modified` when the request's validators match `etag`
+    or `timestamp`, and the response of `view` otherwise.
+    """
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = view(request, *args, **kwargs)
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+class CatalogResponseCacheMixin:
+    """
+    Caches the data of list and detail responses by absolute URL and
+    catalog version. Any `Package` write bumps the version, which
+    invalidates every entry at once; hits skip the database and the
+    serializer. Responses carry an `X-Cache: HIT|MISS` header and the
+    counts are available from `response_cache_stats()`.
+    """
+    response_cache_prefix = 'catalog_responses'
+    response_cache_timeout = 300
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    @classmethod
+    def response_cache_stats(cls):
+        return {
+            outcome: cache.get(
+                '{}_stats/{}'.format(cls.response_cache_prefix, outcome), 0)
+            for outcome in ('hits', 'misses')
+        }
+
+    def count_response_cache(self, outcome):
+        key = '{}_stats/{}'.format(self.response_cache_prefix, outcome)
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        key = '{}/{}/{}'.format(
+            self.response_cache_prefix,
+            model_version(Package),
+            hashlib.sha256(request.build_absolute_uri().encode()).hexdigest(),
+        )
+        entry = cache.get(key)
+        if entry is not None:
+            self.count_response_cache('hits')
+            etag, timestamp, data = entry
+            response = conditional_response(
+                request, etag, timestamp, lambda *a, **kw: Response(data))
+            response['X-Cache'] = 'HIT'
+            return response
+
+        self.count_response_cache('misses')
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and response.has_header('ETag'):
+            last_modified = response.get('Last-Modified')
+            cache.set(key, (
+                response['ETag'],
+                parse_http_date(last_modified) if last_modified else None,
+                response.data,
+            ), timeout=self.response_cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class PackageFacetsMixin:
+    @action(detail=False)
+    def facets(self, request):
+        """
+        Facet counts of the packages matching the current filters.
+        """
+        del request
+        return Response(package_facets(
+            self.filter_queryset(self.get_queryset())))
+
+
+class PackageExportMixin:
+    export_chunk_size = 2000
+
+    @action(detail=False)
+    def export(self, request):
+        """
+        Streams every package matching the current filters as NDJSON,
+        ordered by id and read `export_chunk_size` rows at a time.
+        `?after=<id>` resumes an interrupted export after the last package
+        received, and `?compression=gzip` gzips the stream.
+        """
+        after = request.query_params.get('after', '0')
+        compression = request.query_params.get('compression')
+        if not after.isdigit():
+            raise ParseError('"after" must be a package id.')
+        if compression not in (None, 'gzip'):
+            raise ParseError('Unsupported compression.')
+
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            id__gt=int(after)).order_by('id')
+        chunks = self.export_chunks(queryset)
+        if compression == 'gzip':
+            response = StreamingHttpResponse(
+                gzip_chunks(chunks), content_type='application/gzip')
+            filename = 'packages.ndjson.gz'
+        else:
+            response = StreamingHttpResponse(
+                chunks, content_type=NDJSONParser.media_type)
+            filename = 'packages.ndjson'
+        response['Content-Disposition'] = \
+            'attachment; filename="{}"'.format(filename)
+        return response
+
+    def export_chunks(self, queryset):
+        serializer_class = self.get_serializer_class()
+        lines = []
+        # The rows are read while the response streams, after dispatch
+        with replica_reads():
+            for package in queryset.iterator(
+                    chunk_size=self.export_chunk_size):
+                lines.append(json.dumps(serializer_class(package).data))
+                if len(lines) == self.export_chunk_size:
+                    yield '\n'.join(lines).encode() + b'\n'
+                    lines = []
+        if lines:
+            yield '\n'.join(lines).encode() + b'\n'
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk)
+    yield compressor.flush()
+
+
+class ReplicaReadMixin:
+    """
+    Runs the view's `replica_actions` inside `replica_reads`, so their
+    queries go to a read replica.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower())
+        if action not in self.replica_actions:
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class PackageViewSet(ConditionalGetMixin, PackageFacetsMixin,
+                     OptionalCursorPaginationMixin, FastListMixin,
+                     viewsets.ModelViewSet):
     queryset = Package.objects.all()
-    serializer_class = PackageSerializer
+    serializer_class = PackageWriteAccessSerializer
     pagination_class = PackagePagination
-    filter_backends = (CanWritePackageFilterBackend,)
+    cursor_ordering = ('id',)
+    conditional_models = (Package, PackagePermission)
+    filter_backends = (CanWritePackageFilterBackend, DjangoFilterBackend)
+    filterset_class = PackageFilter
     permission_classes = [TokenHasScope, TokenHasReadWriteScope]
     required_scopes = ['packages']
 
+    def get_queryset(self):
+        return super().get_queryset().annotate_can_write(self.request.user)
 
-class PublicPackageViewSet(viewsets.ModelViewSet):
-    queryset = Package.objects.all().order_by('-price')
+
+class PublicPackageViewSet(ReplicaReadMixin, CatalogResponseCacheMixin,
+                           ConditionalGetMixin, PackageFacetsMixin,
+                           PackageExportMixin, OptionalCursorPaginationMixin,
+                           FastListMixin, viewsets.ModelViewSet):
+    queryset = Package.objects.all().order_by('-price', 'id')
+    # Cached responses are filled from the primary: a replica read cached
+    # under the new catalog version would be served until the next write
+    replica_actions = ('facets',)
     serializer_class = PackageSerializer
     pagination_class = PackagePagination
+    cursor_ordering = ('-price', 'id')
+    conditional_models = (Package,)
+    filter_backends = (PackageSearchFilter, DjangoFilterBackend)
+    filterset_class = PackageFilter
     permission_classes = [BasePermission]
     search_fields = ('name', 'promo')
 
 
-class BookingViewSet(viewsets.ModelViewSet):
+class BookingViewSet(ConditionalGetMixin, FastListMixin,
+                     viewsets.ModelViewSet):
     queryset = Booking.objects.all()
+    conditional_models = (Booking,)
     serializer_class = BookingSerializer
     permission_classes = [BookingObjectPermission]
+    throttle_classes = [SlidingWindowRateThrottle]
+    throttle_scope = 'bookings'
+
+    @action(detail=False, methods=['post'], url_path='import',
+            parser_classes=[JSONParser, NDJSONParser])
+    def bulk_import(self, request):
+        """
+        Creates bookings from a JSON array or an NDJSON body. Valid rows are
+        saved, invalid ones are reported by their index in the upload.
+        """
+        if not isinstance(request.data, list):
+            return Response(
+                {'detail': 'Expected a list of bookings.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        rows, errors = validate_rows(self.get_serializer_class(), request.data)
+        bookings = bulk_create_bookings(rows)
+        return Response(
+            {
+                'created': [booking.pk for booking in bookings],
+                'errors': errors,
+            },
+            status=status.HTTP_201_CREATED if bookings or not errors
+            else status.HTTP_400_BAD_REQUEST,
+        )
+
+    @action(detail=False, methods=['post'], url_path='bulk_delete')
+    def bulk_delete(self, request):
+        """
+        Deletes the bookings listed in `ids` in one transaction. Every
+        booking must exist and pass the object permission check, otherwise
+        nothing is deleted.
+        """
+        serializer = BookingIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = set(serializer.validated_data['ids'])
+
+        bookings = list(self.get_queryset().filter(pk__in=ids))
+        missing = ids - {booking.pk for booking in bookings}
+        if missing:
+            return Response(
+                {'detail': 'Bookings not found.', 'missing': sorted(missing)},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        for booking in bookings:
+            self.check_object_permissions(request, booking)
+
+        delete_bookings(bookings)
+        return Response({'deleted': sorted(ids)})
+
+
+class Echo:
+    """
+    File-like object whose `write` hands the value back, so `csv.writer`
+    can format rows for a streaming response.
+    """
+
+    def write(self, value):
+        return value
 
 
 class UserDataDownloadView(RetrieveAPIView, ProtectedResourceMixin):
     def get(self, request, *args, **kwargs):
         del args, kwargs
-        response = HttpResponse(content_type='text/csv')
+        writer = csv.writer(Echo(), dialect='unix')
+
+        def lines():
+            with replica_reads():
+                for row in user_data_rows(request.user):
+                    yield writer.writerow(row)
+
+        response = StreamingHttpResponse(lines(), content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename="data.csv"'
+        return response
 
-        writer = csv.writer(response, dialect='unix')
-        writer.writerow(['Data for {}'.format(request.user.email)])
-        writer.writerow(['Comments'])
 
-        comments = Comment.objects.filter(created_by=request.user)
-        writer.writerows(comment.text for comment in comments)
+class UserDataExportJobCreateView(APIView):
+    """
+    Starts a background export of the user's data, or returns the export
+    that is already pending or running for them.
+    """
 
-        writer.writerow(['Bookings'])
-        writer.writerow(['package_name', 'package_price', 'start', 'name'])
-        bookings = Booking.objects.filter(email_address=request.user.email)
-        writer.writerows([
-            [
-                booking.package.name, booking.package.price,
-                booking.start, booking.name
-            ] for booking in bookings
-        ])
+    def post(self, request, *args, **kwargs):
+        del args, kwargs
+        job, created = DataExportJob.get_or_start(request.user)
+        if created:
+            transaction.on_commit(lambda: export_user_data.delay(job.id))
+        return Response(
+            DataExportJobSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED,
+        )
 
-        writer.writerow(['Activity Log'])
-        logs = ActivityLog.objects.filter(user=request.user)
-        writer.writerows([[log.action] for log in logs])
 
-        return response
+class UserDataExportJobView(RetrieveAPIView):
+    serializer_class = DataExportJobSerializer
+
+    def get_queryset(self):
+        return DataExportJob.objects.filter(user=self.request.user)
+
+
+class UserDataExportFileView(UserDataExportJobView):
+    def get(self, request, *args, **kwargs):
+        del args, kwargs
+        job = self.get_object()
+        if job.status != DataExportJob.DONE:
+            return Response(
+                DataExportJobSerializer(job).data,
+                status=status.HTTP_409_CONFLICT,
+            )
+        try:
+            export = open(job.file_path, 'rb')
+        except FileNotFoundError:
+            return Response(
+                {'detail': 'The export file is gone, start a new export.'},
+                status=status.HTTP_410_GONE,
+            )
+        return FileResponse(
+            export,
+            as_attachment=True,
+            filename='data.csv.gz',
+            content_type='application/gzip',
+        )
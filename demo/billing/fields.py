@@ -1,31 +1,157 @@
-from django.db.models import TextField
-from cryptography.fernet import Fernet
+from functools import lru_cache
+
+from django.conf import settings
+from django.db.models import QuerySet, TextField
+from django.db.models.query_utils import DeferredAttribute
+from cryptography.fernet import Fernet, MultiFernet
 
 from billing.utils import make_encryption_key
 
-ENCRYPTION_KEY = make_encryption_key('hello-world-256')
+
+@lru_cache(maxsize=None)
+def _cipher_for_keys(keys):
+    return MultiFernet([Fernet(make_encryption_key(key)) for key in keys])
+
+
+def get_cipher():
+    """
+    Returns the cipher for `BILLING_ENCRYPTION_KEYS`. It encrypts with the
+    first (newest) key and decrypts with any of them.
+    """
+    return _cipher_for_keys(tuple(settings.BILLING_ENCRYPTION_KEYS))
 
 
 def encrypt(value):
     if value is None or value == '':
         return value
     encoded = value.encode()
-    return Fernet(ENCRYPTION_KEY).encrypt(encoded)
+    return get_cipher().encrypt(encoded)
 
 
 def decrypt(value):
     if value is None or value == '':
         return value
-    decrypted = Fernet(ENCRYPTION_KEY).decrypt(value)
+    decrypted = get_cipher().decrypt(value)
     return str(decrypted, encoding='utf8')
 
 
+class EncryptedValue:
+    """
+    Ciphertext read from the database that has not been decrypted yet.
+    """
+    __slots__ = ('token',)
+
+    def __init__(self, token):
+        self.token = token
+
+    def __str__(self):
+        return decrypt(self.token)
+
+    def __repr__(self):
+        return '<EncryptedValue>'
+
+
+class DecryptOnAccessAttribute(DeferredAttribute):
+    """
+    Decrypts the field the first time it is read and keeps the plain text
+    on the instance.
+    """
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, EncryptedValue):
+            value = decrypt(value.token)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
 class EncryptedTextField(TextField):
+    """
+    Text field stored encrypted with Fernet.
+
+    With `lazy=True`, rows are loaded without decrypting the column; it is
+    decrypted on first attribute access instead, so queries that never
+    read the field cost no cryptography. Models with lazy fields should
+    use `EncryptedQuerySet` so that `values()` and `values_list()` still
+    return plain text.
+    """
+
+    def __init__(self, *args, lazy=False, **kwargs):
+        self.lazy = lazy
+        if lazy:
+            self.descriptor_class = DecryptOnAccessAttribute
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.lazy:
+            kwargs['lazy'] = True
+        return name, path, args, kwargs
+
     def from_db_value(self, value, expression, connection):
+        if self.lazy and value is not None and value != '':
+            return EncryptedValue(value)
         return decrypt(value)
 
+    def pre_save(self, model_instance, add):
+        # Read past the descriptor so that a value that was never accessed
+        # is saved as its original ciphertext instead of being decrypted
+        # and encrypted again.
+        if self.lazy:
+            return model_instance.__dict__[self.attname]
+        return super().pre_save(model_instance, add)
+
     def to_python(self, value):
+        if isinstance(value, EncryptedValue):
+            return decrypt(value.token)
         return decrypt(value)
 
     def get_prep_value(self, value):
+        if isinstance(value, EncryptedValue):
+            return value.token
         return encrypt(value)
+
+
+def _plain(value):
+    if isinstance(value, EncryptedValue):
+        return decrypt(value.token)
+    return value
+
+
+def _decrypt_row(row):
+    if isinstance(row, dict):
+        return {key: _plain(value) for key, value in row.items()}
+    if isinstance(row, tuple):
+        values = [_plain(value) for value in row]
+        return row._make(values) if hasattr(row, '_make') else tuple(values)
+    return _plain(row)
+
+
+@lru_cache(maxsize=None)
+def _decrypting_iterable(iterable_class):
+    class DecryptingIterable(iterable_class):
+        def __iter__(self):
+            for row in super().__iter__():
+                yield _decrypt_row(row)
+
+    return DecryptingIterable
+
+
+class EncryptedQuerySet(QuerySet):
+    """
+    QuerySet decrypting the lazy encrypted fields returned by `values()`
+    and `values_list()`, which would otherwise yield `EncryptedValue`.
+    """
+
+    def values(self, *fields, **expressions):
+        clone = super().values(*fields, **expressions)
+        clone._iterable_class = _decrypting_iterable(clone._iterable_class)
+        return clone
+
+    def values_list(self, *fields, flat=False, named=False):
+        clone = super().values_list(*fields, flat=flat, named=named)
+        clone._iterable_class = _decrypting_iterable(clone._iterable_class)
+        return clone
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from billing.utils import encrypted_fields, reencrypt_field
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-encrypts every encrypted column with the newest key in '
+        'BILLING_ENCRYPTION_KEYS. Interrupted runs resume from their last '
+        'checkpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore saved checkpoints and start from the first row.')
+
+    def handle(self, *args, **options):
+        del args
+        for model, field in encrypted_fields():
+            count = reencrypt_field(
+                model, field.name,
+                batch_size=options['batch_size'],
+                restart=options['restart'],
+            )
+            self.stdout.write('{}.{}: re-encrypted {} values'.format(
+                model._meta.label, field.name, count))
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:13
+
+import billing.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0002_alter_payment_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='passport_confirmation',
+            field=billing.fields.EncryptedTextField(lazy=True),
+        ),
+    ]
@@ -1,9 +1,21 @@
 from django.db import models
 from django.contrib.auth.models import User
 
-from billing.fields import EncryptedTextField
+from billing.fields import EncryptedQuerySet, EncryptedTextField
 
 
 class Payment(models.Model):
     payer = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
-    passport_confirmation = EncryptedTextField()
+    passport_confirmation = EncryptedTextField(lazy=True)
+
+    objects = EncryptedQuerySet.as_manager()
+
+
+class ReencryptionCheckpoint(models.Model):
+    """
+    Progress of a re-encryption run over one encrypted column, so that an
+    interrupted run can resume after the last re-encrypted row.
+    """
+    name = models.CharField(max_length=200, unique=True)
+    last_pk = models.BigIntegerField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,9 @@
+from demo.celery import app
+
+from billing.utils import encrypted_fields, reencrypt_field
+
+
+@app.task
+def reencrypt_fields(batch_size=500):
+    for model, field in encrypted_fields():
+        reencrypt_field(model, field.name, batch_size=batch_size)
@@ -1,8 +1,15 @@
+from unittest.mock import patch
+
+from cryptography.fernet import InvalidToken, MultiFernet
+
 from django.contrib.auth.models import User
 from django.db import connection
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
-from billing.models import Payment
+import billing.fields
+
+from billing.models import Payment, ReencryptionCheckpoint
+from billing.utils import reencrypt_field
 
 
 class PaymentTestCase(TestCase):
@@ -25,3 +32,106 @@ class PaymentTestCase(TestCase):
             Payment.objects.get(id=payment.id).passport_confirmation,
             secret
         )
+
+    def test_lazy_decryption(self):
+        secret = 'ABC123'
+        payment = Payment.objects.create(
+            payer=User.objects.first(),
+            passport_confirmation=secret,
+        )
+        with patch('billing.fields.decrypt', wraps=billing.fields.decrypt) as decrypt:
+            payments = list(Payment.objects.all())
+            self.assertEqual(decrypt.call_count, 0)
+
+            loaded = Payment.objects.get(id=payment.id)
+            self.assertEqual(loaded.passport_confirmation, secret)
+            self.assertEqual(loaded.passport_confirmation, secret)
+            self.assertEqual(decrypt.call_count, 1)
+        self.assertEqual(len(payments), 1)
+
+    def test_unread_value_is_saved_without_reencrypting(self):
+        payment = Payment.objects.create(passport_confirmation='ABC123')
+        loaded = Payment.objects.get(id=payment.id)
+        loaded.payer = User.objects.create(username='payer')
+        with patch('billing.fields.encrypt') as encrypt, \
+                patch('billing.fields.decrypt') as decrypt:
+            loaded.save()
+            encrypt.assert_not_called()
+            decrypt.assert_not_called()
+        self.assertEqual(
+            Payment.objects.get(id=payment.id).passport_confirmation, 'ABC123')
+
+    def test_values_are_decrypted(self):
+        payment = Payment.objects.create(passport_confirmation='ABC123')
+        self.assertEqual(
+            list(Payment.objects.values('id', 'passport_confirmation')),
+            [{'id': payment.id, 'passport_confirmation': 'ABC123'}])
+        self.assertEqual(
+            list(Payment.objects.values_list(
+                'passport_confirmation', flat=True)),
+            ['ABC123'])
+        row, = Payment.objects.filter(id=payment.id).values_list(
+            'id', 'passport_confirmation', named=True)
+        self.assertEqual(row.passport_confirmation, 'ABC123')
+
+
+class KeyRotationTestCase(TestCase):
+    def setUp(self):
+        self.payments = [
+            Payment.objects.create(passport_confirmation='secret {}'.format(i))
+            for i in range(5)
+        ]
+
+    def read_all(self):
+        return [
+            payment.passport_confirmation
+            for payment in Payment.objects.order_by('id')
+        ]
+
+    def test_reencrypt_with_newest_key(self):
+        with override_settings(BILLING_ENCRYPTION_KEYS=['new-key', 'hello-world-256']):
+            self.assertEqual(
+                reencrypt_field(Payment, 'passport_confirmation', batch_size=2), 5)
+        self.assertFalse(ReencryptionCheckpoint.objects.exists())
+
+        with override_settings(BILLING_ENCRYPTION_KEYS=['new-key']):
+            self.assertEqual(
+                self.read_all(), ['secret {}'.format(i) for i in range(5)])
+
+    def test_resume_from_checkpoint(self):
+        ReencryptionCheckpoint.objects.create(
+            name='billing.Payment.passport_confirmation',
+            last_pk=self.payments[2].id,
+        )
+        with override_settings(BILLING_ENCRYPTION_KEYS=['new-key', 'hello-world-256']):
+            self.assertEqual(
+                reencrypt_field(Payment, 'passport_confirmation', batch_size=2), 2)
+        with override_settings(BILLING_ENCRYPTION_KEYS=['new-key']):
+            self.assertEqual(
+                Payment.objects.get(id=self.payments[4].id).passport_confirmation,
+                'secret 4'
+            )
+            with self.assertRaises(InvalidToken):
+                Payment.objects.get(id=self.payments[0].id).passport_confirmation
+
+    def test_concurrent_writes_are_kept(self):
+        rotate = MultiFernet.rotate
+        written = []
+
+        def rotate_during_a_write(cipher, token):
+            # The row is written after the batch was read
+            if not written:
+                written.append(True)
+                Payment.objects.filter(id=self.payments[1].id).update(
+                    passport_confirmation='changed')
+            return rotate(cipher, token)
+
+        with override_settings(BILLING_ENCRYPTION_KEYS=['new-key', 'hello-world-256']):
+            with patch.object(MultiFernet, 'rotate', autospec=True,
+                              side_effect=rotate_during_a_write):
+                self.assertEqual(
+                    reencrypt_field(Payment, 'passport_confirmation'), 5)
+        with override_settings(BILLING_ENCRYPTION_KEYS=['new-key']):
+            self.assertEqual(
+                self.read_all(),
+                ['secret 0', 'changed', 'secret 2', 'secret 3', 'secret 4'])
@@ -6,3 +6,96 @@ def make_encryption_key(key):
         raise RuntimeError('key must have a length of 32 characters or less')
     s = key + ('_' * (32 - len(key)))
     return base64.urlsafe_b64encode(s.encode())
+
+
+def encrypted_fields():
+    """
+    Yields `(model, field)` for every EncryptedTextField of the installed
+    models.
+    """
+    from django.apps import apps
+    from billing.fields import EncryptedTextField
+
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, EncryptedTextField):
+                yield model, field
+
+
+def reencrypt_field(model, field_name, batch_size=500, restart=False):
+    """
+    Re-encrypts the `field_name` column of `model` with the newest key,
+    `batch_size` rows per transaction. Progress is checkpointed after
+    every batch so an interrupted run resumes where it stopped, unless
+    `restart` is given.
+
+    A row is only updated if it still holds the ciphertext that was read,
+    so a value written during the run is never replaced with the old one;
+    such rows are read and re-encrypted again.
+
+    Returns the number of re-encrypted values.
+    """
+    from django.db import transaction
+    from django.db.models import Case, F, Q, TextField, Value, When
+    from django.db.models.functions import Cast
+    from billing.fields import EncryptedValue, get_cipher
+    from billing.models import ReencryptionCheckpoint
+
+    field = model._meta.get_field(field_name)
+    checkpoint, _ = ReencryptionCheckpoint.objects.get_or_create(
+        name='{}.{}'.format(model._meta.label, field_name))
+    if restart:
+        checkpoint.last_pk = None
+
+    def ciphertexts(queryset):
+        return queryset.annotate(
+            ciphertext=Cast(field_name, TextField())
+        ).values_list('pk', 'ciphertext')
+
+    cipher = get_cipher()
+    queryset = model._base_manager.order_by('pk')
+    total = 0
+    while True:
+        batch = queryset
+        if checkpoint.last_pk is not None:
+            batch = batch.filter(pk__gt=checkpoint.last_pk)
+        rows = list(ciphertexts(batch)[:batch_size])
+        if not rows:
+            break
+
+        pending = {pk: ciphertext for pk, ciphertext in rows if ciphertext}
+        while pending:
+            tokens = {
+                pk: cipher.rotate(ciphertext.encode()).decode()
+                for pk, ciphertext in pending.items()
+            }
+            with transaction.atomic():
+                model._base_manager.filter(pk__in=tokens).update(**{
+                    field_name: Case(
+                        *[
+                            When(
+                                Q(pk=pk, **{field_name: EncryptedValue(
+                                    pending[pk].encode())}),
+                                then=Value(EncryptedValue(token.encode()),
+                                           output_field=field),
+                            )
+                            for pk, token in tokens.items()
+                        ],
+                        default=F(field_name),
+                        output_field=field,
+                    )
+                })
+            current = dict(ciphertexts(model._base_manager.filter(
+                pk__in=tokens)))
+            total += sum(
+                1 for pk, token in tokens.items() if current.get(pk) == token)
+            pending = {
+                pk: ciphertext for pk, ciphertext in current.items()
+                if ciphertext and ciphertext != tokens[pk]
+            }
+
+        checkpoint.last_pk = rows[-1][0]
+        checkpoint.save()
+
+    checkpoint.delete()
+    return total
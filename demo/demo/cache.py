@@ -0,0 +1,452 @@
+import base64
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.db import DatabaseCache
+from django.db import DatabaseError, connections, models, router, transaction
+from django.utils.timezone import now as tz_now
+
+MISSING = object()
+INVALIDATION_SEQ_KEY = 'two_tier/invalidation_seq'
+INVALIDATION_TIMEOUT = 60 * 60
+
+
+def invalidation_key(seq):
+    return 'two_tier/invalidation/{}'.format(seq)
+
+
+class TierStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+class TwoTierCache(BaseCache):
+    """
+    Cache backend keeping a small in-process LRU (L1) in front of a
+    shared cache (L2, another entry of `CACHES`).
+
+    Only keys starting with one of `L1_KEY_PREFIXES` are kept in L1, for
+    at most `L1_TIMEOUT` seconds. Every write to such a key is published
+    to the other processes as an invalidation message in L2: a sequence
+    number incremented with `incr` and the key stored under it. Each
+    process reads the new messages at most every `L1_SYNC_INTERVAL`
+    seconds and evicts those keys, or its whole L1 if it missed any.
+    Everything else, including `incr` and `add`, goes straight to L2.
+
+    With `L1_IMMUTABLE`, the L1 keys must never be written with another
+    value, e.g. because they contain a version, so nothing is published
+    or read and a key only leaves L1 when it times out.
+
+    OPTIONS:
+        L2: alias of the shared cache
+        L1_MAX_ENTRIES: size of the LRU (default 1000)
+        L1_TIMEOUT: seconds an entry may stay in L1 (default 5)
+        L1_SYNC_INTERVAL: seconds between invalidation reads (default 1)
+        L1_KEY_PREFIXES: keys cached in L1 (default: all)
+        L1_IMMUTABLE: whether the L1 keys are never rewritten (default False)
+    """
+
+    def __init__(self, location, params):
+        options = params.get('OPTIONS', {})
+        super().__init__(params)
+        self.l2_alias = options['L2']
+        self.l1_max_entries = options.get('L1_MAX_ENTRIES', 1000)
+        self.l1_timeout = options.get('L1_TIMEOUT', 5)
+        self.sync_interval = options.get('L1_SYNC_INTERVAL', 1)
+        self.key_prefixes = tuple(options.get('L1_KEY_PREFIXES', ('',)))
+        self.immutable = options.get('L1_IMMUTABLE', False)
+        self._l1 = OrderedDict()
+        self._lock = threading.RLock()
+        self._seen_seq = None
+        self._synced_at = 0
+        self._stats = {'l1': TierStats(), 'l2': TierStats()}
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def stats(self):
+        """
+        Returns the hits, misses and hit ratio of each tier in this process.
+        """
+        with self._lock:
+            return {tier: stats.as_dict()
+                    for tier, stats in self._stats.items()}
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {'l1': TierStats(), 'l2': TierStats()}
+
+    def _in_l1(self, key):
+        return key.startswith(self.key_prefixes)
+
+    def _l1_key(self, key, version):
+        return self.make_and_validate_key(key, version=version)
+
+    def _l1_get(self, l1_key):
+        entry = self._l1.get(l1_key)
+        if entry is None:
+            return MISSING
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._l1[l1_key]
+            return MISSING
+        self._l1.move_to_end(l1_key)
+        return pickle.loads(value)
+
+    def _l1_set(self, l1_key, value, timeout):
+        l1_timeout = self.l1_timeout
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None:
+            l1_timeout = min(l1_timeout, timeout)
+        if l1_timeout <= 0:
+            self._l1.pop(l1_key, None)
+            return
+        self._l1[l1_key] = (
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+            time.monotonic() + l1_timeout,
+        )
+        self._l1.move_to_end(l1_key)
+        while len(self._l1) > self.l1_max_entries:
+            self._l1.popitem(last=False)
+
+    def _sync(self):
+        """
+        Applies the invalidation messages published since the last sync.
+        """
+        now = time.monotonic()
+        if self._seen_seq is not None and \
+                now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        seq = self.l2.get(INVALIDATION_SEQ_KEY, 0)
+        seen, self._seen_seq = self._seen_seq, seq
+        if seen is None or seq == seen:
+            return
+        if seq < seen or seq - seen > self.l1_max_entries:
+            self._l1.clear()
+            return
+        keys = [invalidation_key(n) for n in range(seen + 1, seq + 1)]
+        messages = self.l2.get_many(keys)
+        if len(messages) < len(keys):
+            self._l1.clear()
+            return
+        for l1_key in messages.values():
+            self._l1.pop(l1_key, None)
+
+    def _publish(self, l1_key):
+        """
+        Evicts `l1_key` here and tells the other processes to evict it.
+        """
+        self._l1.pop(l1_key, None)
+        self.l2.add(INVALIDATION_SEQ_KEY, 0, timeout=None)
+        seq = self.l2.incr(INVALIDATION_SEQ_KEY)
+        self.l2.set(invalidation_key(seq), l1_key,
+                    timeout=INVALIDATION_TIMEOUT)
+        if self._seen_seq == seq - 1:
+            self._seen_seq = seq
+
+    def get(self, key, default=None, version=None):
+        if not self._in_l1(key):
+            return self._l2_get(key, default, version)
+        l1_key = self._l1_key(key, version)
+        with self._lock:
+            if not self.immutable:
+                self._sync()
+            value = self._l1_get(l1_key)
+            if value is not MISSING:
+                self._stats['l1'].hits += 1
+                return value
+            self._stats['l1'].misses += 1
+        value = self._l2_get(key, MISSING, version)
+        if value is MISSING:
+            return default
+        with self._lock:
+            self._l1_set(l1_key, value, self.l1_timeout)
+        return value
+
+    def _l2_get(self, key, default, version):
+        value = self.l2.get(key, MISSING, version=version)
+        with self._lock:
+            stats = self._stats['l2']
+            if value is MISSING:
+                stats.misses += 1
+                return default
+            stats.hits += 1
+        return value
+
+    def _written(self, key, version, value=MISSING, timeout=DEFAULT_TIMEOUT):
+        if not self._in_l1(key):
+            return
+        l1_key = self._l1_key(key, version)
+        with self._lock:
+            if self.immutable:
+                self._l1.pop(l1_key, None)
+            else:
+                self._publish(l1_key)
+            if value is not MISSING:
+                self._l1_set(l1_key, value, timeout)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout=timeout, version=version)
+        self._written(key, version, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout=timeout, version=version)
+        if added:
+            self._written(key, version, value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        touched = self.l2.touch(key, timeout=timeout, version=version)
+        self._written(key, version)
+        return touched
+
+    def delete(self, key, version=None):
+        deleted = self.l2.delete(key, version=version)
+        self._written(key, version)
+        return deleted
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version=version)
+        self._written(key, version)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        value = self.l2.decr(key, delta, version=version)
+        self._written(key, version)
+        return value
+
+    def has_key(self, key, version=None):
+        return self.get(key, MISSING, version=version) is not MISSING
+
+    def get_many(self, keys, version=None):
+        found = {}
+        l2_keys = []
+        for key in keys:
+            if not self._in_l1(key):
+                l2_keys.append(key)
+                continue
+            value = self.get(key, MISSING, version=version)
+            if value is not MISSING:
+                found[key] = value
+        if l2_keys:
+            l2_found = self.l2.get_many(l2_keys, version=version)
+            with self._lock:
+                self._stats['l2'].hits += len(l2_found)
+                self._stats['l2'].misses += len(l2_keys) - len(l2_found)
+            found.update(l2_found)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout=timeout, version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self._written(key, version, value, timeout)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        self.l2.delete_many(keys, version=version)
+        for key in keys:
+            self._written(key, version)
+
+    def clear(self):
+        self.l2.clear()
+        with self._lock:
+            self._l1.clear()
+            self._seen_seq = None
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
+
+
+class AtomicDatabaseCache(DatabaseCache):
+    """
+    Database cache whose `add`, `incr` and `decr` are atomic across
+    processes, so it can back locks, counters and queues.
+
+    `add` claims an expired entry with a conditional UPDATE and relies on
+    the primary key otherwise. `incr` is a compare-and-swap on the stored
+    value that keeps the entry's expiry, where Django's `incr` is a get
+    and a set that resets it to the default timeout.
+
+    Writes never cull, which would count the table on every write and
+    drop live entries once it is full. Expired entries are deleted by
+    `purge_expired` instead, which must run periodically.
+    """
+    CAS_ATTEMPTS = 100
+
+    def _connection(self):
+        return connections[router.db_for_write(self.cache_model_class)]
+
+    def _expiry(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return datetime.max
+        tz = timezone.utc if settings.USE_TZ else None
+        return datetime.fromtimestamp(timeout, tz=tz).replace(microsecond=0)
+
+    def _encode(self, value):
+        return base64.b64encode(
+            pickle.dumps(value, self.pickle_protocol)).decode('latin1')
+
+    def _now(self, connection):
+        return connection.ops.adapt_datetimefield_value(
+            tz_now().replace(microsecond=0))
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        quote_name = connection.ops.quote_name
+        table = quote_name(self._table)
+        expires = connection.ops.adapt_datetimefield_value(
+            self._expiry(timeout))
+        encoded = self._encode(value)
+        update = 'UPDATE {} SET {} = %s, {} = %s WHERE {} = %s'.format(
+            table, quote_name('value'), quote_name('expires'),
+            quote_name('cache_key'))
+        with connection.cursor() as cursor:
+            cursor.execute(update, [encoded, expires, key])
+            if cursor.rowcount:
+                return
+            try:
+                with transaction.atomic(using=connection.alias):
+                    cursor.execute(
+                        'INSERT INTO {} ({}, {}, {}) VALUES (%s, %s, %s)'.format(
+                            table, quote_name('cache_key'),
+                            quote_name('value'), quote_name('expires')),
+                        [key, encoded, expires],
+                    )
+            except DatabaseError:
+                # Inserted concurrently
+                cursor.execute(update, [encoded, expires, key])
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        quote_name = connection.ops.quote_name
+        expires = connection.ops.adapt_datetimefield_value(
+            self._expiry(timeout))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE {} SET {} = %s WHERE {} = %s AND {} >= %s'.format(
+                    quote_name(self._table), quote_name('expires'),
+                    quote_name('cache_key'), quote_name('expires')),
+                [expires, key, self._now(connection)],
+            )
+            return bool(cursor.rowcount)
+
+    def purge_expired(self, batch_size=1000):
+        """
+        Deletes the expired entries, `batch_size` at a time, and returns
+        how many were deleted.
+        """
+        connection = self._connection()
+        quote_name = connection.ops.quote_name
+        table = quote_name(self._table)
+        deleted = 0
+        while True:
+            now = self._now(connection)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT {} FROM {} WHERE {} < %s {}'.format(
+                        quote_name('cache_key'), table, quote_name('expires'),
+                        connection.ops.limit_offset_sql(None, batch_size)),
+                    [now],
+                )
+                keys = [row[0] for row in cursor.fetchall()]
+                if not keys:
+                    return deleted
+                # Entries written again since the SELECT are kept
+                cursor.execute(
+                    'DELETE FROM {} WHERE {} < %s AND {} IN ({})'.format(
+                        table, quote_name('expires'), quote_name('cache_key'),
+                        ', '.join(['%s'] * len(keys))),
+                    [now, *keys],
+                )
+                deleted += cursor.rowcount
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        quote_name = connection.ops.quote_name
+        table = quote_name(self._table)
+        expires = connection.ops.adapt_datetimefield_value(
+            self._expiry(timeout))
+        encoded = self._encode(value)
+        now = self._now(connection)
+        try:
+            with transaction.atomic(using=connection.alias):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'UPDATE {} SET {} = %s, {} = %s '
+                        'WHERE {} = %s AND {} < %s'.format(
+                            table, quote_name('value'), quote_name('expires'),
+                            quote_name('cache_key'), quote_name('expires')),
+                        [encoded, expires, key, now],
+                    )
+                    if cursor.rowcount:
+                        return True
+                    cursor.execute(
+                        'INSERT INTO {} ({}, {}, {}) VALUES (%s, %s, %s)'.format(
+                            table, quote_name('cache_key'),
+                            quote_name('value'), quote_name('expires')),
+                        [key, encoded, expires],
+                    )
+        except DatabaseError:
+            # The key exists
+            return False
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        quote_name = connection.ops.quote_name
+        table = quote_name(self._table)
+        expression = models.Expression(output_field=models.DateTimeField())
+        converters = connection.ops.get_db_converters(
+            expression) + expression.get_db_converters(connection)
+
+        for _ in range(self.CAS_ATTEMPTS):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT {}, {} FROM {} WHERE {} = %s'.format(
+                        quote_name('value'), quote_name('expires'), table,
+                        quote_name('cache_key')),
+                    [key],
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    raise ValueError("Key '{}' not found.".format(key))
+                stored, expires = row
+                for converter in converters:
+                    expires = converter(expires, expression, connection)
+                if expires < tz_now():
+                    raise ValueError("Key '{}' not found.".format(key))
+                value = pickle.loads(base64.b64decode(
+                    connection.ops.process_clob(stored).encode())) + delta
+                # Only one of concurrent increments sees its value unchanged
+                cursor.execute(
+                    'UPDATE {} SET {} = %s WHERE {} = %s AND {} = %s'.format(
+                        table, quote_name('value'), quote_name('cache_key'),
+                        quote_name('value')),
+                    [self._encode(value), key, stored],
+                )
+                if cursor.rowcount:
+                    return value
+        raise DatabaseError(
+            "Could not increment '{}': too much contention.".format(key))
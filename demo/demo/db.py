@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from demo.throttling import client_ident
+
+_state = threading.local()
+
+
+def replica_synced_key(alias):
+    return '{}/replica_synced_at'.format(alias)
+
+
+def mark_replica_synced(alias, synced_at):
+    """
+    Records that replica `alias` holds every write committed before the
+    `synced_at` timestamp.
+    """
+    cache.set(replica_synced_key(alias), synced_at, timeout=None)
+
+
+def read_replica_alias():
+    """
+    Returns a random replica that is at most `REPLICA_MAX_LAG` seconds
+    behind and was synced after the current client's last write, or the
+    primary when there is none.
+    """
+    if not settings.DATABASE_REPLICAS or getattr(_state, 'pinned', False):
+        return DEFAULT_DB_ALIAS
+    fresh_since = max(time.time() - settings.REPLICA_MAX_LAG,
+                      getattr(_state, 'last_write', None) or 0)
+    synced = cache.get_many(
+        [replica_synced_key(alias) for alias in settings.DATABASE_REPLICAS])
+    fresh = [
+        alias for alias in settings.DATABASE_REPLICAS
+        if synced.get(replica_synced_key(alias), 0) >= fresh_since
+    ]
+    return random.choice(fresh) if fresh else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def replica_reads():
+    """
+    Sends the reads made inside the block to a replica (see
+    `ReadReplicaRouter`). Blocks may be nested.
+    """
+    previous = getattr(_state, 'alias', None)
+    _state.alias = previous or read_replica_alias()
+    try:
+        yield _state.alias
+    finally:
+        _state.alias = previous
+
+
+# App label of the models Django's database cache uses for routing
+CACHE_APP_LABEL = 'django_cache'
+
+
+class ReadReplicaRouter:
+    """
+    Routes the reads of `replica_reads` blocks to `DATABASE_REPLICAS` and
+    everything else, including every write and migration, to the primary.
+    A write pins the rest of the thread's work to the primary. The
+    database cache always uses the primary and never pins.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return DEFAULT_DB_ALIAS
+        alias = getattr(_state, 'alias', None)
+        if alias is not None and getattr(_state, 'pinned', False):
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != CACHE_APP_LABEL:
+            _state.pinned = _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def last_write_key(request):
+    return '{}/last_write'.format(
+        client_ident(request, request.META.get('REMOTE_ADDR')))
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Gives clients read-your-writes: after a request that wrote to the
+    primary, the client only reads from replicas synced after that
+    request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        key = last_write_key(request)
+        _state.pinned = _state.wrote = False
+        _state.last_write = cache.get(key)
+        response = self.get_response(request)
+        if _state.wrote:
+            # Older writes are covered by the REPLICA_MAX_LAG bound
+            cache.set(key, time.time(), timeout=settings.REPLICA_MAX_LAG)
+        return response
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Switches SQLite connections to WAL, so readers do not block the
+    writer, and makes them wait for locks instead of failing at once.
+    """
+    del sender, kwargs
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(
+            'PRAGMA busy_timeout={:d}'.format(settings.SQLITE_BUSY_TIMEOUT))
@@ -62,6 +62,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'oauth2_provider.middleware.OAuth2TokenMiddleware',
+    'demo.db.ReplicaStickinessMiddleware',
+    'api.middleware.ActivityLogBufferMiddleware',
 ]
 
 ROOT_URLCONF = 'demo.urls'
@@ -95,6 +97,29 @@ DATABASES = {
     }
 }
 
+# Read replicas, as a comma separated list of SQLite files kept up to date
+# by running `manage.py sync_sqlite_replicas` periodically. Uncached
+# read-only views read from them.
+DATABASE_REPLICAS = []
+for i, name in enumerate(
+        filter(None, os.environ.get('DJANGO_DB_REPLICAS', '').split(',')), 1):
+    alias = 'replica_{}'.format(i)
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['demo.db.ReadReplicaRouter']
+
+# Replicas that were last synced longer ago than this many seconds are
+# not read from
+REPLICA_MAX_LAG = 60
+
+# Milliseconds SQLite connections wait for a lock before failing
+SQLITE_BUSY_TIMEOUT = 5000
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -137,9 +162,49 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.abspath(os.path.join(BASE_DIR, 'api', 'uploads'))
 MEDIA_URL = '/uploads/'
 
+USER_DATA_EXPORT_ROOT = os.path.join(MEDIA_ROOT, 'exports')
+# Seconds after which a pending or running export is considered dead
+USER_DATA_EXPORT_TIMEOUT = 60 * 60
+# Days finished exports and their files are kept
+USER_DATA_EXPORT_RETENTION_DAYS = 7
+
 FRONTEND_ROOT = os.path.abspath(os.path.join(
     BASE_DIR, '..', 'frontend', 'dist', 'frontend'))
 
+# The default cache keeps a small per-process LRU in front of the cache
+# shared by every web and Celery worker: Redis when CACHE_REDIS_URL is
+# set, a table of the default database otherwise. Both keep add and incr
+# atomic across processes, which the throttles, locks and queues rely on.
+if os.environ.get('CACHE_REDIS_URL'):
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['CACHE_REDIS_URL'],
+    }
+else:
+    SHARED_CACHE = {
+        'BACKEND': 'demo.cache.AtomicDatabaseCache',
+        # Never culled, expired rows are deleted by the
+        # purge-expired-cache-entries task
+        'LOCATION': 'cache_entries',
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'demo.cache.TwoTierCache',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+            'L1_SYNC_INTERVAL': 1,
+            # Catalog responses are keyed by catalog version, so they
+            # never go stale and need no invalidation
+            'L1_KEY_PREFIXES': ['catalog_responses/'],
+            'L1_IMMUTABLE': True,
+        },
+    },
+    'shared': SHARED_CACHE,
+}
+
 # Authentication using OAuth 2.0
 AUTHENTICATION_BACKENDS = (
     'oauth2_provider.backends.OAuth2Backend',
@@ -148,7 +213,8 @@ AUTHENTICATION_BACKENDS = (
 )
 
 OAUTH2_PROVIDER = {
-    'OAUTH2_BACKEND_CLASS': 'oauth2_provider.oauth2_backends.JSONOAuthLibCore',
+    'OAUTH2_BACKEND_CLASS': 'api.oauth2.ResourceOAuthLibCore',
+    'OAUTH2_VALIDATOR_CLASS': 'api.oauth2.CachedOAuth2Validator',
     'SCOPES': {
         'read': 'Read scope',
         'write': 'Write scope',
@@ -164,10 +230,57 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # Per-client limits of the write endpoints, see demo.throttling
+    'DEFAULT_THROTTLE_RATES': {
+        'create_package': '1/5min',
+        'create_package_bulk': '10/hour',
+        'create_comment': '30/min',
+        'bookings': '120/min',
+        'validate': '5/5min',
+    },
 }
 
+# Passphrases of the billing field encryption keys, newest first. Values
+# are encrypted with the first key and decrypted with any of them; run
+# `manage.py reencrypt_fields` after adding a key, then drop the old one.
+BILLING_ENCRYPTION_KEYS = os.environ.get(
+    'BILLING_ENCRYPTION_KEYS', 'hello-world-256').split(',')
+
+# Hand buffered activity log rows to a Celery task instead of writing
+# them at the end of the request
+ACTIVITY_LOG_ASYNC_FLUSH = False
+
+# Comments a user may post in a burst, and how many comments per second
+# they regain afterwards
+COMMENT_THROTTLE_BURST = 1
+COMMENT_THROTTLE_RATE = 1 / 300
+
+# Queue comments in the cache and write them in batches of
+# COMMENT_BATCH_SIZE, or every COMMENT_BATCH_WINDOW seconds, instead of
+# one task per comment. Needs a cache shared with the Celery workers.
+COMMENT_BATCHING = False
+COMMENT_BATCH_SIZE = 500
+COMMENT_BATCH_WINDOW = 5
+
+# Days deleted rows are kept in the DeletedData archive
+DELETED_DATA_RETENTION_DAYS = 90
+
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis'
+CELERY_BEAT_SCHEDULE = {
+    'purge-deleted-data-archive': {
+        'task': 'api.tasks.purge_deleted_data_archive',
+        'schedule': 24 * 60 * 60,
+    },
+    'purge-user-data-exports': {
+        'task': 'api.tasks.purge_user_data_exports',
+        'schedule': 24 * 60 * 60,
+    },
+    'purge-expired-cache-entries': {
+        'task': 'api.tasks.purge_expired_cache_entries',
+        'schedule': 60 * 60,
+    },
+}
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
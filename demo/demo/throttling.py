@@ -0,0 +1,191 @@
+import hashlib
+import math
+import re
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import JsonResponse
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import ScopedRateThrottle
+
+RATE_UNITS = {
+    's': 1, 'sec': 1, 'second': 1,
+    'm': 60, 'min': 60, 'minute': 60,
+    'h': 3600, 'hour': 3600,
+    'd': 86400, 'day': 86400,
+}
+RATE_PATTERN = re.compile(r'^(\d+)/(\d*)([a-z]+)$')
+
+
+class TokenBucket:
+    """
+    Token bucket of `burst` tokens refilled at `rate` tokens per second,
+    kept in the cache under `key` so every process shares it.
+
+    The bucket is read and written under a short lock taken with
+    `cache.add`, so two concurrent requests cannot both spend the last
+    token.
+    """
+    LOCK_TIMEOUT = 1
+    LOCK_ATTEMPTS = 50
+    LOCK_WAIT = 0.002
+
+    def __init__(self, key, rate, burst):
+        self.key = key
+        self.lock_key = key + '/lock'
+        self.rate = rate
+        self.burst = burst
+
+    def consume(self, tokens=1):
+        """
+        Takes `tokens` from the bucket. Returns a pair of whether they were
+        available and the seconds until they will be otherwise.
+        """
+        if not self._lock():
+            return False, 1
+        try:
+            now = time.time()
+            available, updated_at = cache.get(self.key, (self.burst, now))
+            available = min(
+                self.burst, available + (now - updated_at) * self.rate)
+            if available < tokens:
+                return False, math.ceil((tokens - available) / self.rate)
+            cache.set(self.key, (available - tokens, now),
+                      timeout=math.ceil(self.burst / self.rate) + 1)
+            return True, 0
+        finally:
+            cache.delete(self.lock_key)
+
+    def _lock(self):
+        for _ in range(self.LOCK_ATTEMPTS):
+            if cache.add(self.lock_key, True, timeout=self.LOCK_TIMEOUT):
+                return True
+            time.sleep(self.LOCK_WAIT)
+        return False
+
+
+class SlidingWindow:
+    """
+    Sliding-window counter allowing `limit` hits per `period` seconds.
+
+    It keeps one counter per fixed window in the cache and weighs the
+    previous window by how much of it still overlaps the sliding one.
+    Hits are counted with `cache.incr`, and a hit over the limit is taken
+    back, so concurrent requests can never exceed the limit.
+    """
+
+    def __init__(self, key, limit, period):
+        self.key = key
+        self.limit = limit
+        self.period = period
+
+    def hit(self):
+        """
+        Counts a hit. Returns a pair of whether it is allowed and the
+        seconds until the next hit would be otherwise.
+        """
+        now = time.time()
+        window, elapsed = divmod(now, self.period)
+        current_key = '{}/{}'.format(self.key, int(window))
+        cache.add(current_key, 0, timeout=self.period * 2)
+        current = cache.incr(current_key)
+        previous = cache.get('{}/{}'.format(self.key, int(window) - 1), 0)
+
+        overlap = 1 - elapsed / self.period
+        if previous * overlap + current <= self.limit:
+            return True, 0
+        cache.decr(current_key)
+        return False, self._retry_after(previous, current - 1, elapsed)
+
+    def _retry_after(self, previous, current, elapsed):
+        # Seconds until previous * overlap + current + 1 <= limit
+        room = self.limit - 1 - current
+        if room >= 0 and previous:
+            wait = (1 - room / previous) * self.period - elapsed
+        else:
+            wait = (self.period - elapsed) + (
+                1 - (self.limit - 1) / max(current, 1)) * self.period
+        return max(1, math.ceil(wait))
+
+
+def parse_rate(rate):
+    """
+    Parses a rate like "10/min" or "1/5min" into (requests, seconds).
+    """
+    match = RATE_PATTERN.match(rate)
+    if not match or match.group(3) not in RATE_UNITS:
+        raise ValueError('Invalid rate: {!r}'.format(rate))
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * RATE_UNITS[unit]
+
+
+def client_ident(request, fallback):
+    """
+    Identifies the client of `request` by its user, the access token it
+    authenticated with (tokens without a user) or `fallback` (the client
+    IP), in that order. Credentials that did not authenticate are ignored,
+    so clients cannot pick their own identity.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return 'user-{}'.format(user.pk)
+    token = getattr(getattr(request, 'auth', None), 'token', None)
+    if token:
+        return 'token-{}'.format(hashlib.sha256(token.encode()).hexdigest())
+    return 'ip-{}'.format(fallback)
+
+
+class SlidingWindowRateThrottle(ScopedRateThrottle):
+    """
+    Throttles unsafe requests per client with a sliding window, at the
+    rate configured for the view's `throttle_scope` in
+    `DEFAULT_THROTTLE_RATES`.
+    """
+    cache_format = 'throttle/%(scope)s/%(ident)s'
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope or request.method in SAFE_METHODS:
+            return True
+        allowed, self.retry_after = rate_limit_hit(
+            self.scope, client_ident(request, self.get_ident(request)))
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+def rate_limit_hit(scope, ident):
+    limit, period = parse_rate(api_settings.DEFAULT_THROTTLE_RATES[scope])
+    key = SlidingWindowRateThrottle.cache_format % {
+        'scope': scope, 'ident': ident}
+    return SlidingWindow(key, limit, period).hit()
+
+
+def rate_limit(scope):
+    """
+    View decorator applying the `scope` rate limit before the view runs,
+    for views that must be limited ahead of their permission checks.
+    Use it on class-based views with `method_decorator(..., 'dispatch')`.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in SAFE_METHODS:
+                ident = client_ident(
+                    request, ScopedRateThrottle().get_ident(request))
+                allowed, retry_after = rate_limit_hit(scope, ident)
+                if not allowed:
+                    response = JsonResponse(
+                        {'detail': 'Request was throttled. Expected '
+                                   'available in {} seconds.'.format(
+                                       retry_after)},
+                        status=429,
+                    )
+                    response['Retry-After'] = str(retry_after)
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
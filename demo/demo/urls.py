@@ -16,9 +16,16 @@ router.register(r'bookings', api.views.BookingViewSet)
 router.register(r'journal', ugc.views.JournalViewSet)
 
 urlpatterns = [
+    re_path(r'^api/v1/create_package/bulk',
+            api.views.PackageBulkCreateView.as_view()),
     re_path(r'^api/v1/create_package', api.views.PackageCreateView.as_view()),
     re_path(r'^api/v1/create_comment', ugc.views.CommentCreateView.as_view()),
     re_path(r'^api/v1/download', api.views.UserDataDownloadView.as_view()),
+    re_path(r'^api/v1/exports/(?P<pk>[0-9]+)/file',
+            api.views.UserDataExportFileView.as_view()),
+    re_path(r'^api/v1/exports/(?P<pk>[0-9]+)',
+            api.views.UserDataExportJobView.as_view()),
+    re_path(r'^api/v1/exports', api.views.UserDataExportJobCreateView.as_view()),
     re_path(r'^api/v1/validate', twofactorauth.views.ValidateCodeView.as_view()),
     re_path(r'^api/v1/', include(router.urls)),
     path('journal/', ugc.views.JournalView.as_view()),
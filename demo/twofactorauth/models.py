@@ -45,13 +45,13 @@ class TwoFactorAuthCode(models.Model):
             user=user, code=code
         ).order_by('-sent_on').first()
         if existing is None:
-            ActivityLog.objects.create(
+            ActivityLog.record(
                 user=user,
                 action='User entered incorrect two-factor auth code'
             )
             return False
         existing.delete()
-        ActivityLog.objects.create(
+        ActivityLog.record(
             user=user,
             action='User entered correct two-factor auth code'
         )
@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from django.test import TestCase
 
@@ -9,6 +10,7 @@ from twofactorauth.models import TwoFactorAuthCode
 
 class ValidateCodeTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create(username='user')
         self.auth_user = auth_header(create_access_token(self.user))
         TwoFactorAuthCode.objects.create(
@@ -45,3 +47,16 @@ class ValidateCodeTestCase(TestCase):
             activity_log.action,  # type: ignore
             'User entered incorrect two-factor auth code'
         )
+
+    def test_attempts_are_limited_before_validation(self):
+        for _ in range(5):
+            response = self.client.post(
+                '/api/v1/validate', {'auth_code': 'invalid'},
+                **self.auth_user)
+            self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            '/api/v1/validate', {'auth_code': '123456'}, **self.auth_user)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(TwoFactorAuthCode.objects.count(), 1)
+        self.assertEqual(ActivityLog.objects.count(), 5)
@@ -1,9 +1,14 @@
+from django.utils.decorators import method_decorator
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
+from demo.throttling import rate_limit
+
 from twofactorauth.permissions import TwoFactorAuthRequired
 
 
+# Limited in dispatch, because the permission check validates the code
+@method_decorator(rate_limit('validate'), name='dispatch')
 class ValidateCodeView(APIView):
     permission_classes = [TwoFactorAuthRequired]
 
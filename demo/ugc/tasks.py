@@ -1,9 +1,13 @@
-from django.core.cache import cache
+from celery.utils.log import get_task_logger
+from django.conf import settings
 from django.contrib.auth.models import User
 
 from demo.celery import app
 
 from ugc.models import Comment
+from ugc.utils import acquire_queue_lock, release_queue_lock, read_comment_batch, remove_comment_batch
+
+logger = get_task_logger(__name__)
 
 
 @app.task(name='celery.ping')
@@ -11,14 +15,39 @@ def ping():
     pass
 
 
-@app.task(bind=True)
-def create_comment(self, user_id, text):
-    cache_key = '{}/comment_created'.format(user_id)
-    if cache.has_key(cache_key):
-        raise self.retry()
-    obj = Comment.objects.create(
-        created_by=User.objects.get(id=user_id),
-        text=text,
-    )
-    obj.save()
-    cache.set(cache_key, obj.id, timeout=300)
+@app.task
+def create_comment(user_id, text):
+    Comment.objects.create(created_by_id=user_id, text=text)
+
+
+@app.task
+def flush_comments():
+    """
+    Writes the queued comments with one `bulk_create` per batch of
+    `COMMENT_BATCH_SIZE`, and returns the size of every batch. Comments
+    of unknown users are dropped. A batch leaves the queue only once it
+    is saved, so a failed flush is retried by the next one.
+    """
+    if not acquire_queue_lock():
+        return []
+    batch_sizes = []
+    try:
+        while True:
+            end, batch = read_comment_batch(settings.COMMENT_BATCH_SIZE)
+            if end is None:
+                break
+            user_ids = set(User.objects.filter(
+                id__in={user_id for user_id, _ in batch},
+            ).values_list('id', flat=True))
+            comments = Comment.objects.bulk_create(
+                Comment(created_by_id=user_id, text=text)
+                for user_id, text in batch
+                if user_id in user_ids
+            )
+            remove_comment_batch(end)
+            logger.info('Flushed a batch of %d comments (%d dropped)',
+                        len(comments), len(batch) - len(comments))
+            batch_sizes.append(len(comments))
+    finally:
+        release_queue_lock()
+    return batch_sizes
@@ -1,19 +1,22 @@
 import base64
 import re
+import time
 from cryptography.fernet import Fernet
 
 from unittest.mock import patch
 
-from celery.exceptions import Retry
 import django.test
 from django.core.cache import cache
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
-from api.utils import create_access_token, auth_header
+from api.utils import create_access_token, auth_header, capture_model_queries
 from api.models import ActivityLog
+from demo.throttling import TokenBucket
 from ugc.models import Comment, Journal
-from ugc.tasks import create_comment
+from ugc.tasks import create_comment, flush_comments
+from ugc.utils import (
+    QUEUE_TAIL_KEY, QUEUE_WRITE_TIMEOUT, queue_entry_key, queued_comment_count)
 
 
 class CreateCommentTaskTestCase(TestCase):
@@ -24,24 +27,137 @@ class CreateCommentTaskTestCase(TestCase):
     def test_creates_object(self):
         self.assertEqual(Comment.objects.count(), 0)
         user, _ = User.objects.get_or_create(username='test_user')
-        user_id = user.id
-        cache_key = '{}/comment_created'.format(user_id)
-
-        self.assertFalse(cache.has_key(cache_key))
-        create_comment.run(user_id, 'example')
+        create_comment.run(user.id, 'example')
         comment = Comment.objects.first()
         self.assertIsNotNone(comment)
         self.assertEqual(comment.text, 'example')  # type: ignore
-        self.assertEqual(cache.get(cache_key), comment.id)  # type: ignore
-
-    @patch('ugc.tasks.create_comment.retry')
-    def test_retry(self, create_comment_retry):
-        user, _ = User.objects.get_or_create(username='test_user_retry')
-        user_id = user.id
-        create_comment.run(user_id, 'example')
-        create_comment_retry.side_effect = Retry()
-        with self.assertRaises(Retry):
-            create_comment.run(user_id, 'example')
+        self.assertEqual(comment.created_by, user)  # type: ignore
+
+
+@override_settings(COMMENT_THROTTLE_BURST=2, COMMENT_THROTTLE_RATE=1 / 60)
+class CommentThrottleTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def post_comment(self, user_id):
+        return self.client.post(
+            '/api/v1/create_comment',
+            {'user_id': user_id, 'text': 'example'},
+            content_type='application/json',
+        )
+
+    @patch('ugc.views.create_comment')
+    def test_throttled_comments_are_not_enqueued(self, task):
+        self.assertEqual(self.post_comment(1).status_code, 200)
+        self.assertEqual(self.post_comment(1).status_code, 200)
+        response = self.post_comment(1)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(task.apply_async.call_count, 2)
+
+        self.assertEqual(self.post_comment(2).status_code, 200)
+
+    def test_bucket_refills_over_time(self):
+        bucket = TokenBucket('refill', rate=1 / 60, burst=2)
+        # Only the bucket's clock, the cache expires entries by the real one
+        with patch('demo.throttling.time') as clock:
+            clock.time.return_value = 1000
+            self.assertEqual(bucket.consume(), (True, 0))
+            self.assertEqual(bucket.consume(), (True, 0))
+            self.assertEqual(bucket.consume(), (False, 60))
+            clock.time.return_value = 1030
+            self.assertEqual(bucket.consume(), (False, 30))
+            clock.time.return_value = 1060
+            self.assertEqual(bucket.consume(), (True, 0))
+
+
+@override_settings(COMMENT_BATCHING=True, COMMENT_BATCH_SIZE=3,
+                   COMMENT_THROTTLE_BURST=10)
+class CommentBatchingTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create(username='user')
+
+    def post_comments(self, user_ids):
+        for i, user_id in enumerate(user_ids):
+            response = self.client.post(
+                '/api/v1/create_comment',
+                {'user_id': user_id, 'text': 'comment {}'.format(i)},
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 200)
+
+    @patch('ugc.views.flush_comments')
+    def test_flush_is_scheduled_by_size_and_window(self, flush):
+        self.post_comments([self.user.id] * 7)
+        self.assertEqual(flush.delay.call_count, 2)
+        flush.apply_async.assert_called_once_with(countdown=5)
+        self.assertEqual(queued_comment_count(), 7)
+        self.assertEqual(Comment.objects.count(), 0)
+
+    @patch('ugc.views.flush_comments')
+    def test_flush_writes_one_batch_per_query(self, flush):
+        self.post_comments([self.user.id] * 6 + [0])
+        # a user lookup and an insert per batch, no insert for the last one
+        with capture_model_queries() as queries:
+            self.assertEqual(flush_comments.run(), [3, 3, 0])
+        self.assertEqual(len(queries), 5, queries)
+        self.assertEqual(queued_comment_count(), 0)
+        self.assertEqual(
+            list(Comment.objects.values_list('text', flat=True)),
+            ['comment {}'.format(i) for i in range(6)])
+        self.assertEqual(flush_comments.run(), [])
+
+    @patch('ugc.views.flush_comments')
+    def test_form_encoded_comments_are_flushed(self, flush):
+        response = self.client.post(
+            '/api/v1/create_comment',
+            {'user_id': str(self.user.id), 'text': 'form comment'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(
+            '/api/v1/create_comment', {'user_id': 'me', 'text': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(flush_comments.run(), [1])
+        self.assertEqual(Comment.objects.get().created_by, self.user)
+
+    @patch('ugc.views.flush_comments')
+    def test_failed_flush_keeps_the_queue(self, flush):
+        self.post_comments([self.user.id] * 2)
+        with patch('ugc.tasks.Comment.objects.bulk_create',
+                   side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                flush_comments.run()
+        self.assertEqual(queued_comment_count(), 2)
+        self.assertEqual(flush_comments.run(), [2])
+
+    def reserve_comment(self):
+        cache.add(QUEUE_TAIL_KEY, 0, timeout=None)
+        return cache.incr(QUEUE_TAIL_KEY)
+
+    @patch('ugc.views.flush_comments')
+    def test_flush_waits_for_reserved_comments(self, flush):
+        self.post_comments([self.user.id] * 2)
+        seq = self.reserve_comment()
+        self.post_comments([self.user.id])
+        self.assertEqual(flush_comments.run(), [2])
+        self.assertEqual(queued_comment_count(), 2)
+
+        cache.set(queue_entry_key(seq), (self.user.id, 'late'))
+        self.assertEqual(flush_comments.run(), [2])
+        self.assertEqual(
+            list(Comment.objects.values_list('text', flat=True)),
+            ['comment 0', 'comment 1', 'late', 'comment 0'])
+
+        self.reserve_comment()
+        self.post_comments([self.user.id])
+        self.assertEqual(flush_comments.run(), [])
+        self.assertEqual(queued_comment_count(), 2)
+        with patch('ugc.utils.time') as clock:
+            clock.time.return_value = time.time() + QUEUE_WRITE_TIMEOUT
+            self.assertEqual(flush_comments.run(), [1])
+        self.assertEqual(queued_comment_count(), 0)
 
 
 class JournalTestCase(TestCase):
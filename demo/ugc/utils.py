@@ -0,0 +1,105 @@
+import time
+
+from django.core.cache import cache
+
+QUEUE_TAIL_KEY = 'comment_queue/tail'
+QUEUE_HEAD_KEY = 'comment_queue/head'
+QUEUE_LOCK_KEY = 'comment_queue/lock'
+QUEUE_SCHEDULED_KEY = 'comment_queue/scheduled'
+QUEUE_GAP_KEY = 'comment_queue/gap'
+QUEUE_ENTRY_TIMEOUT = 24 * 60 * 60
+QUEUE_LOCK_TIMEOUT = 60
+# How long a writer may take between reserving a sequence number and
+# storing its entry before the entry is given up as lost
+QUEUE_WRITE_TIMEOUT = 60
+
+
+def queue_entry_key(seq):
+    return 'comment_queue/{}'.format(seq)
+
+
+def queue_comment(user_id, text):
+    """
+    Appends a comment to the queue shared through the cache and returns
+    its sequence number. The cache must be shared between the web and
+    worker processes for the queue to reach the workers.
+    """
+    cache.add(QUEUE_TAIL_KEY, 0, timeout=None)
+    seq = cache.incr(QUEUE_TAIL_KEY)
+    cache.set(queue_entry_key(seq), (user_id, text),
+              timeout=QUEUE_ENTRY_TIMEOUT)
+    return seq
+
+
+def queued_comment_count():
+    return cache.get(QUEUE_TAIL_KEY, 0) - cache.get(QUEUE_HEAD_KEY, 0)
+
+
+def read_comment_batch(size):
+    """
+    Reads up to `size` comments from the head of the queue without
+    removing them. Returns the sequence number of the last one read, to
+    pass to `remove_comment_batch` once they are saved, or None when
+    nothing can be read, and the comments as (user_id, text) pairs.
+
+    `queue_comment` reserves a sequence number before it stores the
+    entry, so the batch stops at the first missing entry, which may
+    still be on its way. Entries reserved before a gap was first seen
+    are skipped once it is older than `QUEUE_WRITE_TIMEOUT`, as their
+    writers failed or they expired. Callers must hold the queue lock.
+    """
+    head = cache.get(QUEUE_HEAD_KEY, 0)
+    tail = cache.get(QUEUE_TAIL_KEY, 0)
+    end = min(tail, head + size)
+    if end <= head:
+        return None, []
+    keys = [queue_entry_key(seq) for seq in range(head + 1, end + 1)]
+    entries = cache.get_many(keys)
+    if len(entries) == len(keys):
+        return end, [entries[key] for key in keys]
+
+    gap = cache.get(QUEUE_GAP_KEY)
+    lost_until = head
+    if gap is not None and gap[0] > head \
+            and time.time() - gap[2] >= QUEUE_WRITE_TIMEOUT:
+        lost_until = gap[1]
+    batch = []
+    for seq, key in enumerate(keys, head + 1):
+        if key in entries:
+            batch.append(entries[key])
+        elif seq > lost_until:
+            if gap is None or gap[0] != seq:
+                cache.set(QUEUE_GAP_KEY, (seq, tail, time.time()),
+                          timeout=None)
+            end = seq - 1
+            break
+    if end <= head:
+        return None, []
+    return end, batch
+
+
+def remove_comment_batch(end):
+    """
+    Removes the comments up to sequence number `end` from the queue.
+    Callers must hold the queue lock.
+    """
+    head = cache.get(QUEUE_HEAD_KEY, 0)
+    cache.set(QUEUE_HEAD_KEY, end, timeout=None)
+    cache.delete_many(
+        [queue_entry_key(seq) for seq in range(head + 1, end + 1)])
+
+
+def acquire_queue_lock():
+    return cache.add(QUEUE_LOCK_KEY, True, timeout=QUEUE_LOCK_TIMEOUT)
+
+
+def release_queue_lock():
+    cache.delete(QUEUE_LOCK_KEY)
+
+
+def claim_flush_window(window):
+    """
+    Returns True for the first caller of every `window` seconds, which is
+    then responsible for scheduling the timed flush.
+    """
+    return cache.add(QUEUE_SCHEDULED_KEY, True, timeout=window)
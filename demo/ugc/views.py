@@ -1,17 +1,22 @@
+from django.conf import settings
 from django.http import HttpResponseRedirect
 from django.contrib.auth.models import User
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_protect
 from django.views.generic import TemplateView
 
+from rest_framework.exceptions import Throttled, ValidationError
 from rest_framework.generics import CreateAPIView
 from rest_framework.response import Response
 from rest_framework.permissions import BasePermission
 from rest_framework import viewsets
 
+from demo.throttling import SlidingWindowRateThrottle, TokenBucket
+
 from ugc.models import Comment, Journal
 from ugc.serializers import CommentSerializer, JournalSerializer
-from ugc.tasks import create_comment
+from ugc.tasks import create_comment, flush_comments
+from ugc.utils import queue_comment, claim_flush_window
 from ugc.permissions import OnlyCreatorPermission
 
 
@@ -19,12 +24,19 @@ class CommentCreateView(CreateAPIView):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [BasePermission]
+    throttle_classes = [SlidingWindowRateThrottle]
+    throttle_scope = 'create_comment'
 
     def post(self, request, *args, **kwargs):
         del args, kwargs
+        user_id = self.get_user_id(request)
+        self.throttle(user_id)
+        if settings.COMMENT_BATCHING:
+            self.queue(user_id, request.data.get('text'))
+            return Response(status=200)
         create_comment.apply_async(
             args=(
-                request.data.get('user_id'),
+                user_id,
                 request.data.get('text'),
             ),
             retry=True,
@@ -37,6 +49,43 @@ class CommentCreateView(CreateAPIView):
         )
         return Response(status=200)
 
+    def get_user_id(self, request):
+        """
+        Returns the `user_id` of the request as an int, whether the body is
+        JSON or form-encoded, so the queued comment matches the user's pk.
+        """
+        try:
+            return int(request.data.get('user_id'))
+        except (TypeError, ValueError):
+            raise ValidationError({'user_id': ['A valid integer is required.']})
+
+    def throttle(self, user_id):
+        """
+        Rejects the comment with a 429 before it reaches the broker when
+        the user has used up COMMENT_THROTTLE_BURST comments.
+        """
+        bucket = TokenBucket(
+            '{}/comment_bucket'.format(user_id),
+            rate=settings.COMMENT_THROTTLE_RATE,
+            burst=settings.COMMENT_THROTTLE_BURST,
+        )
+        allowed, retry_after = bucket.consume()
+        if not allowed:
+            raise Throttled(wait=retry_after)
+
+    def queue(self, user_id, text):
+        """
+        Queues the comment for `flush_comments`, which runs as soon as a
+        full batch is waiting, or `COMMENT_BATCH_WINDOW` seconds after the
+        first comment of a window otherwise.
+        """
+        seq = queue_comment(user_id, text)
+        if seq % settings.COMMENT_BATCH_SIZE == 0:
+            flush_comments.delay()
+        elif claim_flush_window(settings.COMMENT_BATCH_WINDOW):
+            flush_comments.apply_async(
+                countdown=settings.COMMENT_BATCH_WINDOW)
+
 
 class JournalViewSet(viewsets.ModelViewSet):
     queryset = Journal.objects.all()